@@ -1,44 +1,250 @@
+import csv
+import hashlib
+import io
+import json
+import math
 import os
-import tempfile
-import urllib.request
-from datetime import datetime, date
-from sqlalchemy.orm import selectinload
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory
+import random
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+from urllib.parse import quote
+import click
+from sqlalchemy.orm import contains_eager, joinedload, load_only, selectinload
+from flask import Blueprint, Flask, Response, current_app, render_template, request, redirect, url_for, flash, abort, send_file, has_request_context, make_response
+from flask import session as user_session, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, current_user, login_required
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
+from markupsafe import Markup
+
+import images
+import instrumentation
+import pubsub
+import security
+import storage
 
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, TextAreaField, IntegerField, DecimalField, DateField, FileField
 from wtforms.validators import DataRequired, Email, Length, NumberRange, Optional
 
-from sqlalchemy import create_engine, Column, Integer, String, Text, Float, ForeignKey, Date, DateTime, and_, or_
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship, scoped_session
+from sqlalchemy import create_engine, Column, Integer, String, Text, Float, ForeignKey, Date, DateTime, Index, and_, bindparam, case, func, or_, event, exists, inspect, select, text, tuple_, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session, attributes, sessionmaker, declarative_base, relationship, scoped_session
 
 # =========================================================
-# App config
+# Configuration (lue par create_app : importer ce module n'a aucun effet de bord)
 # =========================================================
-app = Flask(__name__)
-app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-please-change")
-
-# DB path:
-# - En local: fichier à côté du code
-# - Sur Railway: /tmp (écriture autorisée)
-if os.environ.get("RAILWAY_ENVIRONMENT") or os.environ.get("PORT"):
-    DB_PATH = os.path.join(tempfile.gettempdir(), "staybnb.sqlite3")
-    BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-else:
-    BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-    DB_PATH = os.path.join(BASE_DIR, "staybnb.sqlite3")
-
-app.config["UPLOAD_FOLDER"] = os.path.join(BASE_DIR, "static", "uploads")
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+def _database_url(value):
+    # Heroku/Railway fournissent encore "postgres://", refusé par SQLAlchemy 2
+    if value and value.startswith("postgres://"):
+        value = "postgresql://" + value[len("postgres://"):]
+    return value
+
+def config_from_env():
+    config = {}
+    config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-please-change")
+
+    # Base de données: DATABASE_URL (ex. postgresql://..., sqlite:///chemin.sqlite3)
+    # À défaut, fichier SQLite:
+    # - En local: fichier à côté du code
+    # - Sur Railway: /tmp (écriture autorisée)
+    deployed = bool(os.environ.get("RAILWAY_ENVIRONMENT") or os.environ.get("PORT"))
+    if deployed:
+        import tempfile  # ~10 ms à l'import, inutile hors Railway
+        db_path = os.path.join(tempfile.gettempdir(), "staybnb.sqlite3")
+    else:
+        db_path = os.path.join(BASE_DIR, "staybnb.sqlite3")
+    config["DATABASE_URL"] = _database_url(os.environ.get("DATABASE_URL")) or f"sqlite:///{db_path}"
+    # Réplique en lecture optionnelle (index, fiche annonce en GET, dashboard)
+    config["DATABASE_REPLICA_URL"] = _database_url(os.environ.get("DATABASE_REPLICA_URL"))
+    # Après une écriture, l'utilisateur lit sur le primaire pendant ce délai (retard de réplication)
+    config["DB_REPLICA_STICKY_SECONDS"] = float(os.environ.get("DB_REPLICA_STICKY_SECONDS", 5))
+    config["DB_POOL_SIZE"] = int(os.environ.get("DB_POOL_SIZE", 5))
+    config["DB_MAX_OVERFLOW"] = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    config["DB_POOL_TIMEOUT"] = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+    config["DB_POOL_RECYCLE"] = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    config["DB_POOL_PRE_PING"] = os.environ.get("DB_POOL_PRE_PING", "1") != "0"
+
+    config["UPLOAD_FOLDER"] = os.path.join(BASE_DIR, "static", "uploads")
+    # Stockage des photos : "local" (UPLOAD_FOLDER) ou "s3" (S3, MinIO... voir storage.py)
+    config["STORAGE_BACKEND"] = os.environ.get("STORAGE_BACKEND", "local")
+    config["S3_BUCKET"] = os.environ.get("S3_BUCKET")
+    config["S3_PREFIX"] = os.environ.get("S3_PREFIX", "uploads")
+    config["S3_ENDPOINT_URL"] = os.environ.get("S3_ENDPOINT_URL")
+    config["S3_REGION"] = os.environ.get("S3_REGION")
+    # URL publique du bucket ou du CDN : les pages pointent dessus directement
+    config["S3_PUBLIC_URL"] = os.environ.get("S3_PUBLIC_URL")
+    config["S3_PRESIGN_SECONDS"] = int(os.environ.get("S3_PRESIGN_SECONDS", 3600))
+    # Cache des photos au nom non dérivé du contenu (les autres sont immuables, 1 an)
+    config["UPLOADS_MAX_AGE"] = int(os.environ.get("UPLOADS_MAX_AGE", 3600))
+    # Envoi délégué au serveur web frontal : "x-accel" (nginx) ou "x-sendfile" (Apache, lighttpd)
+    config["UPLOADS_OFFLOAD"] = os.environ.get("UPLOADS_OFFLOAD", "")
+    # Location nginx `internal` qui pointe sur UPLOAD_FOLDER
+    config["UPLOADS_ACCEL_PREFIX"] = os.environ.get("UPLOADS_ACCEL_PREFIX", "/_uploads/")
+    # Recherche: taille de page (pagination par curseur) et index plein texte FTS5 (SQLite)
+    config["SEARCH_PAGE_SIZE"] = int(os.environ.get("SEARCH_PAGE_SIZE", 24))
+    config["SEARCH_FTS"] = os.environ.get("SEARCH_FTS", "1") != "0"
+    config["REVIEWS_PAGE_SIZE"] = int(os.environ.get("REVIEWS_PAGE_SIZE", 10))
+    config["MESSAGES_PAGE_SIZE"] = int(os.environ.get("MESSAGES_PAGE_SIZE", 50))
+    config["INBOX_PAGE_SIZE"] = int(os.environ.get("INBOX_PAGE_SIZE", 20))
+    config["ANALYTICS_TOP_LISTINGS"] = int(os.environ.get("ANALYTICS_TOP_LISTINGS", 50))
+    # Cache des pages anonymes (accueil) et des fragments d'annonces (cartes, fiche)
+    config["PAGE_CACHE_SIZE"] = int(os.environ.get("PAGE_CACHE_SIZE", 512))
+    config["PAGE_CACHE_TTL"] = float(os.environ.get("PAGE_CACHE_TTL", 60))
+    config["FRAGMENT_CACHE_SIZE"] = int(os.environ.get("FRAGMENT_CACHE_SIZE", 4096))
+    config["FRAGMENT_CACHE_TTL"] = float(os.environ.get("FRAGMENT_CACHE_TTL", 300))
+    # max-age envoyé aux navigateurs/CDN pour les pages publiques (revalidation par ETag ensuite)
+    config["HTTP_CACHE_MAX_AGE"] = int(os.environ.get("HTTP_CACHE_MAX_AGE", 30))
+    # Disponibilités: cache mémoire des réservations par annonce (durée de vie, nb d'annonces max)
+    config["AVAILABILITY_CACHE_TTL"] = float(os.environ.get("AVAILABILITY_CACHE_TTL", 60))
+    config["AVAILABILITY_CACHE_SIZE"] = int(os.environ.get("AVAILABILITY_CACHE_SIZE", 10000))
+    # SQLite en WAL : les lecteurs ne sont plus bloqués par l'écrivain
+    config["SQLITE_BUSY_TIMEOUT_MS"] = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+    config["SQLITE_SYNCHRONOUS"] = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    config["BOOKING_MAX_RETRIES"] = int(os.environ.get("BOOKING_MAX_RETRIES", 5))
+    # Threads qui génèrent vignettes et tailles moyennes des photos envoyées
+    config["IMAGE_WORKERS"] = int(os.environ.get("IMAGE_WORKERS", 2))
+    # Notifications SSE : relais Redis entre workers (ex. redis://localhost:6379/0), sinon en mémoire
+    config["EVENTS_BROKER_URL"] = os.environ.get("EVENTS_BROKER_URL")
+    config["EVENTS_HEARTBEAT_SECONDS"] = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", 15))
+    config["EVENTS_MAX_PENDING"] = int(os.environ.get("EVENTS_MAX_PENDING", 100))
+    # Hachage des mots de passe (méthode werkzeug) ; les anciens hashs sont refaits à la connexion
+    config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    # Hachages simultanés par processus (0 : dans la requête) et tentatives en attente au-delà
+    config["AUTH_WORKERS"] = int(os.environ.get("AUTH_WORKERS", 2))
+    config["AUTH_MAX_PENDING"] = int(os.environ.get("AUTH_MAX_PENDING", 16))
+    # Connexion/inscription : rafale autorisée puis tentatives par minute, par IP et par email
+    config["LOGIN_IP_BURST"] = int(os.environ.get("LOGIN_IP_BURST", 20))
+    config["LOGIN_IP_PER_MINUTE"] = float(os.environ.get("LOGIN_IP_PER_MINUTE", 10))
+    config["LOGIN_EMAIL_BURST"] = int(os.environ.get("LOGIN_EMAIL_BURST", 5))
+    config["LOGIN_EMAIL_PER_MINUTE"] = float(os.environ.get("LOGIN_EMAIL_PER_MINUTE", 2))
+    # Derrière un reverse proxy : nombre de proxies dont on croit X-Forwarded-For (IP du client).
+    # Sur Railway, le proxy de la plateforme : sans lui toutes les connexions partageraient
+    # l'IP du proxy, donc un seul seau. En local, personne à croire (en-tête falsifiable).
+    config["TRUSTED_PROXIES"] = int(os.environ.get("TRUSTED_PROXIES", 1 if deployed else 0))
+    # Utilisateur connecté gardé en mémoire entre les requêtes (durée de vie, nb d'utilisateurs max)
+    config["USER_CACHE_TTL"] = float(os.environ.get("USER_CACHE_TTL", 30))
+    config["USER_CACHE_SIZE"] = int(os.environ.get("USER_CACHE_SIZE", 10000))
+    # Mesures (voir instrumentation.py) : seuil du journal des requêtes SQL lentes
+    config["SLOW_QUERY_MS"] = float(os.environ.get("SLOW_QUERY_MS", 100))
+    # Profilage par échantillonnage, désactivé à 0 : piles des requêtes plus lentes que ce seuil
+    config["PROFILE_SLOW_MS"] = float(os.environ.get("PROFILE_SLOW_MS", 0))
+    config["PROFILE_INTERVAL_MS"] = float(os.environ.get("PROFILE_INTERVAL_MS", 5))
+    config["PROFILE_DIR"] = os.environ.get("PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+    return config
 
 # =========================================================
 # Database (SQLAlchemy)
 # =========================================================
-engine = create_engine(f"sqlite:///{DB_PATH}", echo=False, future=True)
-SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False))
+def _sqlite_begin(conn):
+    # execution_options(sqlite_begin="IMMEDIATE") prend le verrou d'écriture dès le début
+    conn.exec_driver_sql(f"BEGIN {conn.get_execution_options().get('sqlite_begin', 'DEFERRED')}")
+
+def make_engine(url, config):
+    url = make_url(url)
+    options = {"echo": False, "future": True, "pool_pre_ping": config["DB_POOL_PRE_PING"]}
+    if not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+        options.update(
+            pool_size=config["DB_POOL_SIZE"],
+            max_overflow=config["DB_MAX_OVERFLOW"],
+            pool_timeout=config["DB_POOL_TIMEOUT"],
+            pool_recycle=config["DB_POOL_RECYCLE"],
+        )
+    eng = create_engine(url, **options)
+    if eng.dialect.name == "sqlite":
+        @event.listens_for(eng, "connect")
+        def _sqlite_pragmas(dbapi_conn, connection_record):
+            # On désactive la gestion implicite des transactions de pysqlite pour émettre
+            # nous-mêmes BEGIN / BEGIN IMMEDIATE (voir _sqlite_begin).
+            dbapi_conn.isolation_level = None
+            cur = dbapi_conn.cursor()
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute(f"PRAGMA busy_timeout={config['SQLITE_BUSY_TIMEOUT_MS']:d}")
+            cur.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+            cur.close()
+
+        event.listen(eng, "begin", _sqlite_begin)
+    return eng
+
+class Database:
+    """Moteurs créés à la première utilisation, d'après la config passée à init_app.
+
+    Écritures (et lectures par défaut) sur le primaire ; lectures des routes en
+    lecture seule sur la réplique si DATABASE_REPLICA_URL est défini.
+    """
+
+    def __init__(self):
+        self.config = {}
+        self.fts = None  # table FTS5 présente ? détecté au premier usage
+        self._engine = self._read_engine = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.dispose()
+        self.config = app.config
+        self.fts = None
+
+    @property
+    def has_replica(self):
+        return bool(self.config.get("DATABASE_REPLICA_URL"))
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    self._engine = make_engine(self.config["DATABASE_URL"], self.config)
+        return self._engine
+
+    @property
+    def read_engine(self):
+        if not self.has_replica:
+            return self.engine
+        if self._read_engine is None:
+            with self._lock:
+                if self._read_engine is None:
+                    self._read_engine = make_engine(self.config["DATABASE_REPLICA_URL"], self.config)
+        return self._read_engine
+
+    def dispose(self):
+        for eng in (self._engine, self._read_engine):
+            if eng is not None:
+                eng.dispose()
+        self._engine = self._read_engine = None
+
+database = Database()
+
+_primary_sessions = sessionmaker(autoflush=False, autocommit=False)
+_replica_sessions = sessionmaker(autoflush=False, autocommit=False)
+
+def session_factory():
+    return _primary_sessions(bind=database.engine)
+
+def read_session_factory():
+    return _replica_sessions(bind=database.read_engine)
+
+SessionLocal = scoped_session(session_factory)
+ReadSessionLocal = scoped_session(read_session_factory)
+
+@event.listens_for(_primary_sessions, "after_flush")
+def _stick_to_primary(db, flush_context):
+    if database.has_replica and has_request_context():
+        user_session["db_primary_until"] = time.time() + current_app.config["DB_REPLICA_STICKY_SECONDS"]
+
+def read_session():
+    """Session pour les routes en lecture seule : réplique, sauf juste après une écriture."""
+    if request.method not in ("GET", "HEAD") or user_session.get("db_primary_until", 0) > time.time():
+        return SessionLocal()
+    return ReadSessionLocal()
+
 Base = declarative_base()
 
 class User(Base):
@@ -72,18 +278,48 @@ class Listing(Base):
     bedrooms = Column(Integer, nullable=False)
     bathrooms = Column(Integer, nullable=False)
     amenities = Column(Text, default="")
+    # Colonnes normalisées (minuscules, sans accents) pour une recherche indexée
+    city_norm = Column(String(120), nullable=False, default="", server_default="")
+    country_norm = Column(String(120), nullable=False, default="", server_default="")
+    # Agrégats des avis, tenus à jour dans la transaction qui insère l'avis
+    review_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_avg = Column(Float, nullable=False, default=0, server_default="0")
+    # Sert de Last-Modified à la fiche (annonce, photos ou avis modifiés)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     photos = relationship("Photo", back_populates="listing", cascade="all, delete-orphan")
     bookings = relationship("Booking", back_populates="listing", cascade="all, delete-orphan")
     reviews = relationship("Review", back_populates="listing", cascade="all, delete-orphan")
     host = relationship("User", back_populates="listings")
 
+    __table_args__ = (
+        Index("ix_listings_city_norm_id", "city_norm", "id"),
+        Index("ix_listings_country_norm_id", "country_norm", "id"),
+        Index("ix_listings_max_guests_id", "max_guests", "id"),
+        Index("ix_listings_price_id", "price_per_night", "id"),
+        Index("ix_listings_rating_id", "rating_avg", "id"),
+    )
+
 class Photo(Base):
     __tablename__ = "photos"
     id = Column(Integer, primary_key=True)
     listing_id = Column(Integer, ForeignKey("listings.id"))
     filename = Column(String(255), nullable=False)
+    # SHA-256 du fichier d'origine : les nouveaux fichiers sont nommés d'après lui
+    content_hash = Column(String(64))
+    # Dimensions de l'original et des déclinaisons (images.VARIANTS), NULL tant qu'elles ne sont pas générées
+    width = Column(Integer)
+    height = Column(Integer)
+    thumb_width = Column(Integer)
+    thumb_height = Column(Integer)
+    medium_width = Column(Integer)
+    medium_height = Column(Integer)
     listing = relationship("Listing", back_populates="photos")
 
+    __table_args__ = (Index("ix_photos_filename", "filename"),)
+
+PHOTO_DIMENSIONS = ("width", "height", "thumb_width", "thumb_height", "medium_width", "medium_height")
+
 class Booking(Base):
     __tablename__ = "bookings"
     id = Column(Integer, primary_key=True)
@@ -98,10 +334,51 @@ class Booking(Base):
     user = relationship("User")
     listing = relationship("Listing", back_populates="bookings")
 
+    __table_args__ = (
+        Index("ix_bookings_listing_status_dates", "listing_id", "status", "start_date", "end_date"),
+    )
+
+# Statuts qui bloquent le calendrier
+ACTIVE_BOOKING_STATUSES = ("pending", "confirmed", "paid")
+
+class Conversation(Base):
+    """Fil entre deux utilisateurs, identifié par la paire (plus petit id, plus grand id)."""
+    __tablename__ = "conversations"
+    id = Column(Integer, primary_key=True)
+    low_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    high_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # Résumé pour la boîte de réception, tenu à jour à chaque Message inséré
+    last_message_id = Column(Integer)
+    last_message_at = Column(DateTime)
+    last_sender_id = Column(Integer)
+    last_preview = Column(String(200), nullable=False, server_default="")
+    low_unread = Column(Integer, nullable=False, server_default="0")
+    high_unread = Column(Integer, nullable=False, server_default="0")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    low_user = relationship("User", foreign_keys=[low_user_id])
+    high_user = relationship("User", foreign_keys=[high_user_id])
+
+    __table_args__ = (
+        Index("ux_conversations_pair", "low_user_id", "high_user_id", unique=True),
+        # Boîte de réception : un parcours d'index par côté de la paire, du plus récent au plus ancien
+        Index("ix_conversations_low_last", "low_user_id", "last_message_at", "id"),
+        Index("ix_conversations_high_last", "high_user_id", "last_message_at", "id"),
+    )
+
+    def other_user(self, user_id):
+        return self.high_user if user_id == self.low_user_id else self.low_user
+
+    def unread_for(self, user_id):
+        return self.low_unread if user_id == self.low_user_id else self.high_unread
+
+def conversation_pair(a, b):
+    return (a, b) if a < b else (b, a)
+
 class Message(Base):
     __tablename__ = "messages"
     id = Column(Integer, primary_key=True)
     listing_id = Column(Integer, ForeignKey("listings.id"), nullable=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"))
     sender_id = Column(Integer, ForeignKey("users.id"))
     receiver_id = Column(Integer, ForeignKey("users.id"))
     body = Column(Text, nullable=False)
@@ -109,6 +386,9 @@ class Message(Base):
     sender = relationship("User", foreign_keys=[sender_id], back_populates="messages_sent")
     receiver = relationship("User", foreign_keys=[receiver_id], back_populates="messages_received")
 
+    # Pages d'une conversation par curseur sur l'id : coût constant quelle que soit sa longueur
+    __table_args__ = (Index("ix_messages_conversation_id", "conversation_id", "id"),)
+
 class Review(Base):
     __tablename__ = "reviews"
     id = Column(Integer, primary_key=True)
@@ -120,65 +400,437 @@ class Review(Base):
     listing = relationship("Listing", back_populates="reviews")
     user = relationship("User")
 
-Base.metadata.create_all(engine)
+    __table_args__ = (
+        Index("ix_reviews_listing_created", "listing_id", "created_at", "id"),
+    )
+
+class ListingNight(Base):
+    # Calendrier matérialisé : une ligne par nuit occupée (réservation active).
+    # La clé primaire (listing_id, night) interdit aussi deux réservations sur la même nuit.
+    __tablename__ = "listing_nights"
+    listing_id = Column(Integer, ForeignKey("listings.id"), primary_key=True)
+    night = Column(Date, primary_key=True)
+    booking_id = Column(Integer, ForeignKey("bookings.id"), nullable=False, index=True)
+
+# Rapports hôtes : agrégats tenus à jour à chaque écriture de réservation (voir
+# _report_booking), pour ne jamais relire tout l'historique d'un hôte.
+# Chiffre d'affaires réparti par nuit ; réservation et sa valeur comptées au jour d'arrivée.
+REPORTED_BOOKING_STATUSES = ("confirmed", "paid")
+STAT_COLUMNS = ("nights", "revenue", "bookings", "booking_value")
+
+class HostDailyStats(Base):
+    __tablename__ = "host_daily_stats"
+    host_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    nights = Column(Integer, nullable=False, default=0, server_default="0")
+    revenue = Column(Float, nullable=False, default=0, server_default="0")
+    bookings = Column(Integer, nullable=False, default=0, server_default="0")
+    booking_value = Column(Float, nullable=False, default=0, server_default="0")
+
+class ListingMonthlyStats(Base):
+    __tablename__ = "listing_monthly_stats"
+    listing_id = Column(Integer, ForeignKey("listings.id"), primary_key=True)
+    month = Column(Date, primary_key=True)  # premier jour du mois
+    host_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    nights = Column(Integer, nullable=False, default=0, server_default="0")
+    revenue = Column(Float, nullable=False, default=0, server_default="0")
+    bookings = Column(Integer, nullable=False, default=0, server_default="0")
+    booking_value = Column(Float, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (Index("ix_listing_monthly_stats_host_month", "host_id", "month"),)
+
+def stay_nights(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days)]
+
+def _night_rows(booking):
+    return [{"listing_id": booking.listing_id, "night": n, "booking_id": booking.id}
+            for n in stay_nights(booking.start_date, booking.end_date)]
+
+@event.listens_for(Booking, "after_insert")
+def _occupy_nights(mapper, connection, target):
+    if target.status in ACTIVE_BOOKING_STATUSES and target.end_date > target.start_date:
+        connection.execute(ListingNight.__table__.insert(), _night_rows(target))
+
+@event.listens_for(Booking, "after_update")
+def _sync_nights(mapper, connection, target):
+    changed = any(attributes.get_history(target, key).has_changes()
+                  for key in ("status", "start_date", "end_date", "listing_id"))
+    if not changed:
+        return
+    connection.execute(ListingNight.__table__.delete().where(ListingNight.booking_id == target.id))
+    _occupy_nights(mapper, connection, target)
+
+@event.listens_for(Booking, "after_delete")
+def _release_nights(mapper, connection, target):
+    connection.execute(ListingNight.__table__.delete().where(ListingNight.booking_id == target.id))
+
+REPORTED_FIELDS = ("status", "listing_id", "start_date", "end_date", "total_price")
+
+def _booking_state(target, previous=False):
+    # Valeurs avant la modification en cours (previous=True) ou actuelles
+    state = {}
+    for key in REPORTED_FIELDS:
+        deleted = attributes.get_history(target, key).deleted if previous else None
+        state[key] = deleted[0] if deleted else getattr(target, key)
+    return state
+
+def _stat_rows(host_id, state, sign):
+    nights = stay_nights(state["start_date"], state["end_date"])
+    per_night = state["total_price"] / len(nights)
+    first_month = state["start_date"].replace(day=1)
+    daily, monthly = [], {}
+    for night in nights:
+        arrival = night == state["start_date"]
+        daily.append({"host_id": host_id, "day": night, "nights": sign, "revenue": sign * per_night,
+                      "bookings": sign if arrival else 0, "booking_value": sign * state["total_price"] if arrival else 0})
+        month = night.replace(day=1)
+        row = monthly.setdefault(month, {"listing_id": state["listing_id"], "month": month, "host_id": host_id,
+                                         "nights": 0, "revenue": 0.0, "bookings": 0, "booking_value": 0.0})
+        row["nights"] += sign
+        row["revenue"] += sign * per_night
+    monthly[first_month]["bookings"] += sign
+    monthly[first_month]["booking_value"] += sign * state["total_price"]
+    return daily, list(monthly.values())
+
+def _add_stats(connection, table, keys, rows):
+    # Upsert additif : deux réservations simultanées ne perdent pas d'incrément
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    stmt = upsert(table)
+    stmt = stmt.on_conflict_do_update(index_elements=keys,
+                                      set_={col: table.c[col] + stmt.excluded[col] for col in STAT_COLUMNS})
+    connection.execute(stmt, rows)
+
+def _drop_empty_stats(connection, table, keys, rows=None):
+    # Sans nuit ni réservation, la ligne ne porte plus qu'un résidu d'arrondi : supprimée,
+    # sinon chaque annulation laisserait des zéros dans les rapports et les exports
+    stmt = table.delete().where(table.c.nights == 0, table.c.bookings == 0)
+    if rows is None:
+        connection.execute(stmt)
+        return
+    stmt = stmt.where(*(table.c[key] == bindparam(f"stat_{key}") for key in keys))
+    connection.execute(stmt, [{f"stat_{key}": row[key] for key in keys} for row in rows])
+
+def _report_booking(connection, state, sign):
+    if state["status"] not in REPORTED_BOOKING_STATUSES or state["end_date"] <= state["start_date"]:
+        return
+    host_id = connection.execute(select(Listing.host_id).where(Listing.id == state["listing_id"])).scalar()
+    if host_id is None:
+        return
+    daily, monthly = _stat_rows(host_id, state, sign)
+    _add_stats(connection, HostDailyStats.__table__, ("host_id", "day"), daily)
+    _add_stats(connection, ListingMonthlyStats.__table__, ("listing_id", "month"), monthly)
+    if sign < 0:
+        _drop_empty_stats(connection, HostDailyStats.__table__, ("host_id", "day"), daily)
+        _drop_empty_stats(connection, ListingMonthlyStats.__table__, ("listing_id", "month"), monthly)
+
+@event.listens_for(Booking, "after_insert")
+def _report_new_booking(mapper, connection, target):
+    _report_booking(connection, _booking_state(target), 1)
+
+def _keep_previous(target, value, oldvalue, initiator):
+    return value
+
+# Ancienne valeur chargée avant toute affectation, même sur une instance expirée
+# après commit : sans elle l'historique n'a rien à retirer des agrégats
+for _key in REPORTED_FIELDS:
+    event.listen(getattr(Booking, _key), "set", _keep_previous, active_history=True, retval=True)
+
+@event.listens_for(Booking, "after_update")
+def _report_booking_change(mapper, connection, target):
+    # Changement de statut (ou de dates, de prix) : on retire l'ancienne contribution, on ajoute la nouvelle
+    if not any(attributes.get_history(target, key).has_changes() for key in REPORTED_FIELDS):
+        return
+    _report_booking(connection, _booking_state(target, previous=True), -1)
+    _report_booking(connection, _booking_state(target), 1)
+
+@event.listens_for(Booking, "after_delete")
+def _report_deleted_booking(mapper, connection, target):
+    _report_booking(connection, _booking_state(target), -1)
+
+def _apply_rating(connection, listing_id, count_delta, rating_delta):
+    # Incréments calculés par la base : pas de lecture-modification-écriture en Python
+    new_count = Listing.review_count + count_delta
+    new_sum = Listing.rating_sum + rating_delta
+    connection.execute(
+        update(Listing.__table__).where(Listing.id == listing_id).values(
+            review_count=new_count,
+            rating_sum=new_sum,
+            rating_avg=case((new_count > 0, new_sum * 1.0 / new_count), else_=0),
+            updated_at=datetime.utcnow(),
+        )
+    )
+
+@event.listens_for(Review, "after_insert")
+def _count_review(mapper, connection, target):
+    _apply_rating(connection, target.listing_id, 1, target.rating)
+
+@event.listens_for(Review, "after_delete")
+def _uncount_review(mapper, connection, target):
+    _apply_rating(connection, target.listing_id, -1, -target.rating)
+
+def _conversation_id(connection, a, b):
+    low, high = conversation_pair(a, b)
+    table = Conversation.__table__
+    query = select(table.c.id).where(table.c.low_user_id == low, table.c.high_user_id == high)
+    found = connection.execute(query).scalar()
+    if found is None:
+        # Deux premiers messages simultanés : le second ignore le conflit sur la paire
+        if connection.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as pg_insert
+            stmt = pg_insert(table).on_conflict_do_nothing()
+        else:
+            stmt = table.insert().prefix_with("OR IGNORE", dialect="sqlite")
+        connection.execute(stmt.values(low_user_id=low, high_user_id=high, created_at=datetime.utcnow()))
+        found = connection.execute(query).scalar()
+    return found
+
+@event.listens_for(Message, "before_insert")
+def _attach_conversation(mapper, connection, target):
+    if target.conversation_id is None:
+        target.conversation_id = _conversation_id(connection, target.sender_id, target.receiver_id)
+
+@event.listens_for(Message, "after_insert")
+def _summarize_conversation(mapper, connection, target):
+    c = Conversation.__table__.c
+    low, _ = conversation_pair(target.sender_id, target.receiver_id)
+    unread = c.high_unread if target.sender_id == low else c.low_unread
+    connection.execute(update(Conversation.__table__).where(c.id == target.conversation_id).values({
+        c.last_message_id: target.id,
+        c.last_message_at: target.created_at,
+        c.last_sender_id: target.sender_id,
+        c.last_preview: target.body[:200],
+        unread: unread + 1,
+    }))
+
+@event.listens_for(Photo, "after_insert")
+@event.listens_for(Photo, "after_update")
+@event.listens_for(Photo, "after_delete")
+def _touch_listing_photos(mapper, connection, target):
+    connection.execute(update(Listing.__table__).where(Listing.id == target.listing_id).values(updated_at=datetime.utcnow()))
+
+def normalize_text(value):
+    # "Île-de-France " -> "ile-de-france"
+    value = unicodedata.normalize("NFKD", value or "")
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return " ".join(value.casefold().split())
+
+@event.listens_for(Listing, "before_insert")
+@event.listens_for(Listing, "before_update")
+def _normalize_listing(mapper, connection, target):
+    target.city_norm = normalize_text(target.city)
+    target.country_norm = normalize_text(target.country)
 
 # =========================================================
-# Seed auto si base vide (annonces de démo)
+# Schéma (création + mises à niveau légères des bases existantes)
 # =========================================================
-def seed_if_empty():
-    db = SessionLocal()
-    try:
-        if db.query(Listing).count() > 0:
-            return
-        demo = User(name="Hôte Démo", email="demo@staybnb.local", password_hash=generate_password_hash("demo1234"))
-        db.add(demo); db.commit()
-
-        demo_listings = [
-            {"title":"Loft lumineux près du Canal Saint-Martin","description":"Grand loft refait à neuf, hauteur sous plafond, cuisine ouverte, idéal pour un city-break.","city":"Paris","country":"France","price":145,"max_guests":3,"bedrooms":1,"bathrooms":1,"amenities":"Wi-Fi, Cuisine équipée, Lave-linge, Chauffage, TV","photos":["https://picsum.photos/id/1067/1200/800","https://picsum.photos/id/1018/1200/800"]},
-            {"title":"Appartement cosy près du Vieux-Port","description":"Ambiance méditerranéenne, balcon ensoleillé, parfait pour explorer Marseille.","city":"Marseille","country":"France","price":95,"max_guests":2,"bedrooms":1,"bathrooms":1,"amenities":"Wi-Fi, Climatisation, Cuisine, Machine à café","photos":["https://picsum.photos/id/1025/1200/800","https://picsum.photos/id/103/1200/800"]},
-            {"title":"Duplex design sur les quais","description":"Style contemporain, vue sur la Saône, idéal pour les amoureux d’architecture.","city":"Lyon","country":"France","price":120,"max_guests":4,"bedrooms":2,"bathrooms":1,"amenities":"Wi-Fi, Lave-vaisselle, Chauffage, TV, Lit bébé","photos":["https://picsum.photos/id/1043/1200/800","https://picsum.photos/id/1050/1200/800"]},
-            {"title":"Studio vue mer Promenade des Anglais","description":"Face à la mer, terrasse privée et accès plage à 2 minutes.","city":"Nice","country":"France","price":130,"max_guests":2,"bedrooms":1,"bathrooms":1,"amenities":"Wi-Fi, Climatisation, Terrasse, Ascenseur","photos":["https://picsum.photos/id/1011/1200/800","https://picsum.photos/id/1016/1200/800"]},
-            {"title":"Maison en pierre proche des vignobles","description":"Charme de l’ancien, grande cuisine, jardin au calme à 20 min de Bordeaux.","city":"Bordeaux","country":"France","price":160,"max_guests":5,"bedrooms":3,"bathrooms":2,"amenities":"Wi-Fi, Cheminée, Jardin, Parking, Barbecue","photos":["https://picsum.photos/id/1040/1200/800","https://picsum.photos/id/1008/1200/800"]},
-        ]
-
-        updir = app.config["UPLOAD_FOLDER"]
-        os.makedirs(updir, exist_ok=True)
-
-        for item in demo_listings:
-            l = Listing(
-                host_id=demo.id, title=item["title"], description=item["description"],
-                city=item["city"], country=item["country"],
-                price_per_night=float(item["price"]), max_guests=item["max_guests"],
-                bedrooms=item["bedrooms"], bathrooms=item["bathrooms"], amenities=item["amenities"]
-            )
-            db.add(l); db.commit()
-            for i, url in enumerate(item["photos"]):
-                fname = f"seed_{l.id}_{i}.jpg"
-                try:
-                    urllib.request.urlretrieve(url, os.path.join(updir, fname))
-                    db.add(Photo(listing_id=l.id, filename=fname)); db.commit()
-                except Exception as e:
-                    print("Seed photo error:", e)
-        print("✅ Base de démo initialisée.")
-    finally:
-        db.close()
+def _add_missing_columns(conn):
+    insp = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(conn.dialect)}"
+            if col.server_default is not None:
+                ddl += f" DEFAULT '{col.server_default.arg}'"
+                if not col.nullable:
+                    ddl += " NOT NULL"
+            conn.execute(text(ddl))
+
+def _backfill_normalized(conn):
+    rows = conn.execute(text("SELECT id, city, country FROM listings WHERE city_norm = '' OR country_norm = ''")).all()
+    if rows:
+        conn.execute(
+            text("UPDATE listings SET city_norm = :c, country_norm = :p WHERE id = :id"),
+            [{"id": r.id, "c": normalize_text(r.city), "p": normalize_text(r.country)} for r in rows],
+        )
+
+def _backfill_nights(conn):
+    # Bases antérieures au calendrier : on le reconstruit une fois depuis les réservations
+    if conn.execute(select(ListingNight.listing_id).limit(1)).first():
+        return
+    bookings = conn.execute(
+        select(Booking.id, Booking.listing_id, Booking.start_date, Booking.end_date)
+        .where(Booking.status.in_(ACTIVE_BOOKING_STATUSES)).order_by(Booking.id)
+    ).all()
+    rows = {}
+    for b in bookings:
+        for row in _night_rows(b):
+            rows.setdefault((row["listing_id"], row["night"]), row)
+    if rows:
+        conn.execute(ListingNight.__table__.insert(), list(rows.values()))
+
+def _backfill_ratings(conn):
+    conn.execute(text(
+        "UPDATE listings SET "
+        "review_count = (SELECT COUNT(*) FROM reviews r WHERE r.listing_id = listings.id), "
+        "rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM reviews r WHERE r.listing_id = listings.id) "
+        "WHERE review_count = 0 AND EXISTS (SELECT 1 FROM reviews r WHERE r.listing_id = listings.id)"
+    ))
+    conn.execute(text(
+        "UPDATE listings SET rating_avg = rating_sum * 1.0 / review_count "
+        "WHERE review_count > 0 AND rating_avg = 0"
+    ))
+
+def _backfill_conversations(conn):
+    # Messages antérieurs aux conversations : une conversation par paire, sans non-lus
+    if conn.execute(text("SELECT 1 FROM messages WHERE conversation_id IS NULL LIMIT 1")).first() is None:
+        return
+    low = "CASE WHEN m.sender_id < m.receiver_id THEN m.sender_id ELSE m.receiver_id END"
+    high = "CASE WHEN m.sender_id < m.receiver_id THEN m.receiver_id ELSE m.sender_id END"
+    conn.execute(text(
+        "INSERT INTO conversations (low_user_id, high_user_id, last_preview, low_unread, high_unread, created_at) "
+        f"SELECT DISTINCT {low}, {high}, '', 0, 0, CURRENT_TIMESTAMP FROM messages m "
+        f"WHERE m.conversation_id IS NULL AND NOT EXISTS (SELECT 1 FROM conversations c "
+        f"WHERE c.low_user_id = {low} AND c.high_user_id = {high})"
+    ))
+    conn.execute(text(
+        "UPDATE messages SET conversation_id = (SELECT c.id FROM conversations c, messages m "
+        f"WHERE m.id = messages.id AND c.low_user_id = {low} AND c.high_user_id = {high}) "
+        "WHERE conversation_id IS NULL"
+    ))
+    conn.execute(text(
+        "UPDATE conversations SET last_message_id = "
+        "(SELECT MAX(m.id) FROM messages m WHERE m.conversation_id = conversations.id)"
+    ))
+    conn.execute(text(
+        "UPDATE conversations SET "
+        "last_message_at = (SELECT m.created_at FROM messages m WHERE m.id = conversations.last_message_id), "
+        "last_sender_id = (SELECT m.sender_id FROM messages m WHERE m.id = conversations.last_message_id), "
+        "last_preview = (SELECT SUBSTR(m.body, 1, 200) FROM messages m WHERE m.id = conversations.last_message_id) "
+        "WHERE last_message_id IS NOT NULL"
+    ))
+
+def _backfill_host_stats(conn):
+    # Réservations antérieures aux rapports : agrégats recalculés une fois depuis le calendrier
+    _drop_empty_stats(conn, HostDailyStats.__table__, ("host_id", "day"))
+    _drop_empty_stats(conn, ListingMonthlyStats.__table__, ("listing_id", "month"))
+    if conn.execute(select(HostDailyStats.host_id).limit(1)).first():
+        return
+    if conn.execute(select(Booking.id).where(Booking.status.in_(REPORTED_BOOKING_STATUSES)).limit(1)).first() is None:
+        return
+    if conn.dialect.name == "postgresql":
+        month = "CAST(date_trunc('month', n.night) AS DATE)"
+    else:
+        month = "date(n.night, 'start of month')"
+    statuses = ", ".join(f"'{s}'" for s in REPORTED_BOOKING_STATUSES)
+    nights = (
+        f"SELECT l.host_id, n.listing_id, n.night, {month} AS month, b.total_price * 1.0 / c.n AS revenue, "
+        "CASE WHEN n.night = b.start_date THEN 1 ELSE 0 END AS bookings, "
+        "CASE WHEN n.night = b.start_date THEN b.total_price ELSE 0 END AS booking_value "
+        "FROM listing_nights n JOIN bookings b ON b.id = n.booking_id JOIN listings l ON l.id = n.listing_id "
+        "JOIN (SELECT booking_id, COUNT(*) AS n FROM listing_nights GROUP BY booking_id) c ON c.booking_id = b.id "
+        f"WHERE b.status IN ({statuses})"
+    )
+    conn.execute(text(
+        "INSERT INTO host_daily_stats (host_id, day, nights, revenue, bookings, booking_value) "
+        "SELECT host_id, night, COUNT(*), SUM(revenue), SUM(bookings), SUM(booking_value) "
+        f"FROM ({nights}) t GROUP BY host_id, night"
+    ))
+    conn.execute(text(
+        "INSERT INTO listing_monthly_stats (listing_id, month, host_id, nights, revenue, bookings, booking_value) "
+        "SELECT listing_id, month, MIN(host_id), COUNT(*), SUM(revenue), SUM(bookings), SUM(booking_value) "
+        f"FROM ({nights}) t GROUP BY listing_id, month"
+    ))
+
+def _backfill_updated_at(conn):
+    conn.execute(text("UPDATE listings SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL"))
+
+def _setup_fts(conn):
+    # Table virtuelle FTS5 "external content" synchronisée par triggers:
+    # toute écriture sur listings (new_listing, seed, ...) met l'index à jour.
+    if conn.dialect.name != "sqlite":
+        return False
+    created = not inspect(conn).has_table("listings_fts")
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5("
+        "title, description, amenities, content='listings', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS listings_fts_ai AFTER INSERT ON listings BEGIN "
+        "INSERT INTO listings_fts(rowid, title, description, amenities) "
+        "VALUES (new.id, new.title, new.description, new.amenities); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS listings_fts_ad AFTER DELETE ON listings BEGIN "
+        "INSERT INTO listings_fts(listings_fts, rowid, title, description, amenities) "
+        "VALUES ('delete', old.id, old.title, old.description, old.amenities); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS listings_fts_au AFTER UPDATE OF title, description, amenities ON listings BEGIN "
+        "INSERT INTO listings_fts(listings_fts, rowid, title, description, amenities) "
+        "VALUES ('delete', old.id, old.title, old.description, old.amenities); "
+        "INSERT INTO listings_fts(rowid, title, description, amenities) "
+        "VALUES (new.id, new.title, new.description, new.amenities); END"
+    ))
+    if created:
+        conn.execute(text("INSERT INTO listings_fts(listings_fts) VALUES ('rebuild')"))
+    return True
+
+def init_schema():
+    """Crée ou met à niveau le schéma (commande `flask init-db`, pas au démarrage des workers)."""
+    engine = database.engine
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        _add_missing_columns(conn)
+        for table in Base.metadata.sorted_tables:
+            for idx in table.indexes:
+                idx.create(conn, checkfirst=True)
+        _backfill_normalized(conn)
+        _backfill_nights(conn)
+        _backfill_ratings(conn)
+        _backfill_updated_at(conn)
+        _backfill_conversations(conn)
+        _backfill_host_stats(conn)
+    database.fts = False
+    if database.config["SEARCH_FTS"]:
+        try:
+            with engine.begin() as conn:
+                database.fts = _setup_fts(conn)
+        except OperationalError as e:
+            # SQLite compilé sans FTS5: on retombe sur la recherche LIKE
+            print("FTS5 indisponible:", e)
 
-seed_if_empty()
+def fts_enabled():
+    if database.fts is None:
+        database.fts = database.config["SEARCH_FTS"] and inspect(database.read_engine).has_table("listings_fts")
+    return database.fts
 
 # =========================================================
 # Auth (Flask-Login)
 # =========================================================
-login_manager = LoginManager(app)
-login_manager.login_view = "login"
+login_manager = LoginManager()
+login_manager.login_view = "main.login"
 
-@login_manager.user_loader
-def load_user(user_id):
-    db = SessionLocal()
+# Réglés par create_app (voir security.py)
+passwords = security.PasswordHasher()
+credential_pool = security.CredentialPool()
+ip_limiter = security.RateLimiter("ip")
+email_limiter = security.RateLimiter("email")
+
+def hash_password(password):
+    return passwords.hash(password)
+
+def _fetch_user(user_id):
+    # Session dédiée : fermer la session "scoped" détacherait les objets de la vue en cours
+    db = session_factory()
     try:
-        return db.get(User, int(user_id))
+        return db.get(User, user_id)
     finally:
         db.close()
 
+@login_manager.user_loader
+def load_user(user_id):
+    # Objet détaché, partagé entre requêtes : seules ses colonnes sont lues
+    user_id = int(user_id)
+    return user_cache.get_or_set(user_id, lambda: _fetch_user(user_id))
+
 # =========================================================
 # Forms
 # =========================================================
@@ -222,104 +874,930 @@ class ReviewForm(FlaskForm):
     comment = TextAreaField("Avis", validators=[DataRequired(), Length(min=5)])
     submit = SubmitField("Publier l'avis")
 
+bp = Blueprint("main", __name__, cli_group=None)
+
+# =========================================================
+# Chargement des relations, déclaré par vue
+# =========================================================
+# Chaque vue déclare ce que son template lit, pour éviter les chargements
+# paresseux ligne par ligne (N+1) et les colonnes inutiles (description...).
+# Le budget de requêtes par route est vérifié par benchmarks/query_budget.py.
+LOAD_STRATEGIES = {
+    "index": lambda: [
+        load_only(Listing.id, Listing.title, Listing.city, Listing.country, Listing.price_per_night,
+                  Listing.max_guests, Listing.bedrooms, Listing.bathrooms, Listing.review_count, Listing.rating_avg),
+        selectinload(Listing.photos).load_only(Photo.filename, Photo.thumb_width, Photo.medium_width),
+    ],
+    "listing_detail.reviews": lambda: [
+        joinedload(Review.user).load_only(User.name),
+    ],
+    "dashboard.my_listings": lambda: [
+        load_only(Listing.id, Listing.title, Listing.city, Listing.country, Listing.price_per_night),
+    ],
+    "dashboard.my_bookings": lambda: [
+        joinedload(Booking.listing).load_only(Listing.title),
+    ],
+    # La requête joint déjà listings : on remplit Booking.listing depuis cette jointure
+    "dashboard.incoming": lambda: [
+        contains_eager(Booking.listing).load_only(Listing.title),
+        joinedload(Booking.user).load_only(User.name),
+    ],
+    "messages.inbox": lambda: [
+        joinedload(Conversation.low_user).load_only(User.name),
+        joinedload(Conversation.high_user).load_only(User.name),
+    ],
+}
+
+def load_options(view):
+    return LOAD_STRATEGIES[view]()
+
+# =========================================================
+# Cache (pages anonymes, fragments d'annonces)
+# =========================================================
+class TTLCache:
+    """Cache mémoire borné : éviction LRU + expiration, compteurs exposés sur /metrics."""
+
+    def __init__(self, name, max_size=1024, ttl=60):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_set(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class CacheVersions:
+    """Numéros de version inclus dans les clés de cache.
+
+    Invalider = incrémenter : les anciennes entrées ne sont plus jamais lues et
+    sortent du LRU. `catalog` couvre le contenu des annonces (pages d'accueil),
+    `calendar` les disponibilités (recherches avec dates), et chaque annonce a
+    sa propre version pour ses fragments. Compteurs locaux au processus : les
+    écritures des autres workers arrivent par le relais d'événements
+    (EVENTS_BROKER_URL), sinon seulement à expiration (TTL).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = 0
+        self._listings = {}
+        self._base = 0
+        self.catalog = self.calendar = 0
+
+    def listing(self, listing_id):
+        return self._listings.get(listing_id, self._base)
+
+    def touch_all(self):
+        with self._lock:
+            self._counter += 1
+            self.catalog = self.calendar = self._base = self._counter
+            self._listings.clear()
+
+    def touch(self, listing_id, content=True):
+        with self._lock:
+            self._counter += 1
+            self.calendar = self._counter
+            if content:
+                self.catalog = self._counter
+                self._listings[listing_id] = self._counter
+
+# Tailles et durées fixées par create_app
+page_cache = TTLCache("page")
+fragment_cache = TTLCache("fragment")
+user_cache = TTLCache("user")
+cache_versions = CacheVersions()
+
+SEARCH_ARGS = ("city", "country", "guests", "q", "start", "end", "sort", "after")
+
+def page_cacheable():
+    # Pages partagées : visiteurs anonymes, sans message flash en attente
+    return request.method == "GET" and not current_user.is_authenticated and "_flashes" not in user_session
+
+def cached_response(body, last_modified, etag, public=True):
+    resp = make_response(body)
+    resp.set_etag(etag)
+    if last_modified:
+        resp.last_modified = last_modified
+    resp.vary.add("Cookie")
+    if public:
+        resp.cache_control.public = True
+        resp.cache_control.max_age = current_app.config["HTTP_CACHE_MAX_AGE"]
+    else:
+        resp.cache_control.private = True
+        resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+def body_etag(body):
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+@bp.app_template_global()
+def listing_card(listing):
+    start, end = request.args.get("start"), request.args.get("end")
+    key = ("card", listing.id, cache_versions.listing(listing.id), start, end)
+    return Markup(fragment_cache.get_or_set(key, lambda: render_template("_listing_card.html", l=listing)))
+
+@bp.app_template_global()
+def photo_url(photo, variant=None, fmt="jpg"):
+    filename = photo.filename
+    if variant and photo.thumb_width:
+        filename = images.variant_name(photo.filename, variant, fmt)
+    # Bucket public / CDN : URL directe, sans passer par l'application
+    return get_storage().url(filename) or url_for("main.uploads", filename=filename)
+
+@bp.app_template_global()
+def photo_srcset(photo, fmt):
+    # "…_thumb.webp 480w, …_medium.webp 1280w" : le navigateur choisit selon `sizes`
+    return ", ".join(f"{photo_url(photo, variant, fmt)} {getattr(photo, variant + '_width')}w"
+                     for variant in images.VARIANTS)
+
 # =========================================================
 # Helpers
 # =========================================================
-def overlap(a_start, a_end, b_start, b_end):
-    return a_start <= b_end and b_start <= a_end
+def _overlap_clause(start, end):
+    # Séjours en intervalles semi-ouverts [arrivée, départ[ : le jour du départ est libre
+    return and_(Booking.status.in_(ACTIVE_BOOKING_STATUSES), Booking.start_date < end, Booking.end_date > start)
+
+def booking_conflicts(db, listing_id, start, end):
+    """Un seul EXISTS, servi par ix_bookings_listing_status_dates."""
+    return db.query(exists().where(Booking.listing_id == listing_id, _overlap_clause(start, end))).scalar()
+
+class AvailabilityIndex:
+    """Réservations actives à venir de chaque annonce, triées par arrivée, en mémoire.
+
+    Pour chaque annonce on garde les arrivées triées et le maximum cumulé des
+    départs : [start, end[ chevauche une réservation ssi, parmi celles arrivées
+    avant `end`, le départ le plus tardif est après `start` -> une bisection.
+    Seules les réservations qui se terminent après le jour du chargement sont
+    gardées : l'index répond pour les séjours qui commencent ce jour-là ou après.
+    Les entrées sont invalidées au commit d'une réservation (voir plus bas) et
+    expirent après AVAILABILITY_CACHE_TTL (écritures faites par d'autres workers).
+
+    Chargement toujours sur le primaire : une réplique en retard remettrait en
+    cache l'état d'avant une réservation. Lecture seulement (affichage, API) ;
+    la réservation elle-même ne se fie qu'à book_listing.
+    """
+
+    def __init__(self, ttl=60, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._generation = 0  # incrémenté à chaque invalidation
+        self._lock = threading.Lock()
+
+    def _load(self, listing_ids, since):
+        loaded = {listing_id: ([], []) for listing_id in listing_ids}
+        db = session_factory()
+        try:
+            rows = db.query(Booking.listing_id, Booking.start_date, Booking.end_date).filter(
+                Booking.listing_id.in_(listing_ids), Booking.status.in_(ACTIVE_BOOKING_STATUSES),
+                Booking.end_date > since,
+            ).order_by(Booking.listing_id, Booking.start_date).all()
+        finally:
+            db.close()
+        for listing_id, start, end in rows:
+            starts, max_ends = loaded[listing_id]
+            starts.append(start)
+            max_ends.append(max(end, max_ends[-1]) if max_ends else end)
+        return loaded
+
+    def _get_many(self, listing_ids, since):
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            generation = self._generation
+            for listing_id in listing_ids:
+                entry = self._entries.get(listing_id)
+                if entry and now - entry[0] < self.ttl and entry[1] <= since:
+                    self._entries.move_to_end(listing_id)
+                    found[listing_id] = entry[2:]
+                else:
+                    missing.append(listing_id)
+        if missing:
+            # Toutes les annonces absentes du cache en une requête
+            loaded = self._load(missing, since)
+            with self._lock:
+                # Invalidation pendant le chargement : résultat peut-être antérieur au
+                # commit, servi à cet appel mais pas gardé
+                stored = loaded.items() if generation == self._generation else ()
+                for listing_id, (starts, max_ends) in stored:
+                    self._entries[listing_id] = (now, since, starts, max_ends)
+                    self._entries.move_to_end(listing_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            found.update(loaded)
+        return found
+
+    def free_ids(self, listing_ids, start, end):
+        """Parmi `listing_ids`, celles libres sur [start, end[ ; `start` ne doit pas être passé."""
+        free = set()
+        for listing_id, (starts, max_ends) in self._get_many(set(listing_ids), date.today()).items():
+            i = bisect_left(starts, end)
+            if i == 0 or max_ends[i - 1] <= start:
+                free.add(listing_id)
+        return free
+
+    def invalidate(self, listing_id=None):
+        with self._lock:
+            self._generation += 1
+            if listing_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(listing_id, None)
+
+availability = AvailabilityIndex()
+
+# Annonces modifiées par la transaction en cours ; au commit on invalide le cache
+# de disponibilités et les caches de pages/fragments qui les affichent.
+def _touch(target, listing_id, content):
+    touched = Session.object_session(target).info.setdefault("touched_listings", {})
+    touched[listing_id] = touched.get(listing_id, False) or content
+
+@event.listens_for(Booking, "after_insert")
+@event.listens_for(Booking, "after_update")
+@event.listens_for(Booking, "after_delete")
+def _track_booking_change(mapper, connection, target):
+    _touch(target, target.listing_id, content=False)
+
+@event.listens_for(Listing, "after_insert")
+@event.listens_for(Listing, "after_update")
+@event.listens_for(Listing, "after_delete")
+def _track_listing_change(mapper, connection, target):
+    _touch(target, target.id, content=True)
+
+@event.listens_for(Photo, "after_insert")
+@event.listens_for(Photo, "after_update")
+@event.listens_for(Photo, "after_delete")
+@event.listens_for(Review, "after_insert")
+@event.listens_for(Review, "after_delete")
+def _track_listing_content(mapper, connection, target):
+    _touch(target, target.listing_id, content=True)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _track_user_change(mapper, connection, target):
+    Session.object_session(target).info.setdefault("touched_users", set()).add(target.id)
+
+def _apply_invalidation(data):
+    for listing_id, content in data["listings"]:
+        availability.invalidate(listing_id)
+        cache_versions.touch(listing_id, content)
+    for user_id in data["users"]:
+        user_cache.discard(user_id)
+
+def _drop_local_caches(data=None):
+    # Relais reconnecté : des invalidations ont pu se perdre, on repart de zéro
+    for cache in (page_cache, fragment_cache, user_cache):
+        cache.clear()
+    availability.invalidate()
+    cache_versions.touch_all()
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_listing_caches(session):
+    data = {"listings": list(session.info.pop("touched_listings", {}).items()),
+            "users": list(session.info.pop("touched_users", ()))}
+    if data["listings"] or data["users"]:
+        _apply_invalidation(data)
+        # Autres workers : par le relais d'événements (EVENTS_BROKER_URL), sinon à expiration
+        broker.broadcast("invalidate", data)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_touched_listings(session):
+    session.info.pop("touched_listings", None)
+    session.info.pop("touched_users", None)
+    session.info.pop("pending_events", None)
+
+# =========================================================
+# Notifications en direct (SSE, voir pubsub.py)
+# =========================================================
+broker = pubsub.Broker()
+broker.on_broadcast("invalidate", _apply_invalidation)
+broker.on_broadcast("resync", _drop_local_caches)
+
+# Publiées seulement après le commit : un client ne voit jamais un message annulé
+def _notify(target, user_id, event, data):
+    Session.object_session(target).info.setdefault("pending_events", []).append((user_id, event, data))
+
+@event.listens_for(Message, "after_insert")
+def _notify_message(mapper, connection, target):
+    _notify(target, target.receiver_id, "chat", {
+        "id": target.id,
+        "conversation_id": target.conversation_id,
+        "sender_id": target.sender_id,
+        "body": target.body,
+        "created_at": target.created_at.isoformat(),
+    })
+
+@event.listens_for(Booking, "after_update")
+def _notify_booking_status(mapper, connection, target):
+    if attributes.get_history(target, "status").has_changes():
+        _notify_booking(mapper, connection, target)
+
+@event.listens_for(Booking, "after_insert")
+def _notify_booking(mapper, connection, target):
+    host_id, title = connection.execute(
+        select(Listing.host_id, Listing.title).where(Listing.id == target.listing_id)).one()
+    data = {"id": target.id, "listing_id": target.listing_id, "listing_title": title, "status": target.status,
+            "start": target.start_date.isoformat(), "end": target.end_date.isoformat()}
+    for user_id in {host_id, target.user_id}:
+        _notify(target, user_id, "booking", dict(data, role="host" if user_id == host_id else "guest"))
+
+@event.listens_for(Session, "after_commit")
+def _publish_events(session):
+    for user_id, event_name, data in session.info.pop("pending_events", []):
+        broker.publish(user_id, event_name, data)
 
 def listing_available(db, listing_id, start, end):
-    bookings = db.query(Booking).filter(Booking.listing_id==listing_id, Booking.status.in_(["pending","confirmed","paid"])).all()
-    for b in bookings:
-        if overlap(b.start_date, b.end_date, start, end):
-            return False
-    return True
+    # Lecture servie par l'index (au plus AVAILABILITY_CACHE_TTL de retard sur les
+    # autres workers) : indicatif, une réservation passe toujours par book_listing.
+    return listing_id in available_listing_ids(db, [listing_id], start, end)
+
+def _is_lock_error(exc):
+    return "database is locked" in str(exc) or "database is busy" in str(exc)
+
+def book_listing(listing_id, user_id, start, end, guests, price_per_night, status="confirmed"):
+    """Vérifie et insère une réservation de façon atomique.
+
+    La transaction démarre en BEGIN IMMEDIATE : le verrou d'écriture est pris
+    avant l'EXISTS, aucun autre worker ne peut insérer entre la vérification
+    et l'insertion. La clé primaire de listing_nights reste le garde-fou si le
+    moteur ne sérialise pas les écrivains. Renvoie la réservation, ou None si
+    les dates sont prises. Réessaie avec backoff si la base reste verrouillée.
+    """
+    retries = current_app.config["BOOKING_MAX_RETRIES"]
+    for attempt in range(retries + 1):
+        db = session_factory()
+        try:
+            db.connection(execution_options={"sqlite_begin": "IMMEDIATE"})
+            if booking_conflicts(db, listing_id, start, end):
+                db.rollback()
+                return None
+            booking = Booking(user_id=user_id, listing_id=listing_id,
+                              start_date=start, end_date=end, guests=guests,
+                              total_price=(end - start).days * price_per_night, status=status)
+            db.add(booking)
+            db.commit()
+            db.expunge(booking)
+            return booking
+        except IntegrityError:
+            db.rollback()
+            return None
+        except OperationalError as e:
+            db.rollback()
+            if not _is_lock_error(e) or attempt == retries:
+                raise
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+        finally:
+            db.close()
+
+def available_listing_ids(db, listing_ids, start, end):
+    """Parmi `listing_ids`, celles libres sur [start, end[ (au plus une requête)."""
+    listing_ids = set(listing_ids)
+    if not listing_ids:
+        return set()
+    if start >= date.today():
+        return availability.free_ids(listing_ids, start, end)
+    # Séjour dans le passé : hors de l'index, qui ne garde que les réservations à venir
+    busy = db.query(Booking.listing_id).filter(
+        Booking.listing_id.in_(listing_ids), _overlap_clause(start, end)
+    ).distinct()
+    return listing_ids - {row.listing_id for row in busy}
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+# Plus grand entier qu'accepte une colonne INTEGER (SQLite, BIGINT PostgreSQL)
+SQL_INT_MAX = 2 ** 63 - 1
+
+def parse_int(value, minimum=0, maximum=SQL_INT_MAX):
+    """Entier dans [minimum, maximum], sinon None : un nombre hors bornes ferait
+    échouer la requête (OverflowError au moment de lier le paramètre)."""
+    try:
+        n = int(value)
+    except (TypeError, ValueError):
+        return None
+    return n if minimum <= n <= maximum else None
+
+def _prefix_filter(column, prefix):
+    # Préfixe via un intervalle [p, p+1[ : exploite l'index, contrairement à ILIKE '%x%'
+    # Le dernier code point n'a pas de successeur : on incrémente le précédent
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return column >= prefix
+    upper = stem[:-1] + chr(ord(stem[-1]) + 1)
+    return and_(column >= prefix, column < upper)
+
+def _fts_query(q):
+    # Chaque mot devient un préfixe entre guillemets (pas d'injection de syntaxe FTS5) ;
+    # les caractères de contrôle (\x00 coupe la chaîne MATCH) deviennent des espaces
+    q = "".join(" " if unicodedata.category(c)[0] == "C" else c for c in q)
+    terms = [t.replace('"', '""') for t in normalize_text(q).split()]
+    return " ".join(f'"{t}"*' for t in terms)
+
+def _parse_cursor(value, *types):
+    # "4.5:123" -> (4.5, 123) ; None si le curseur est invalide ou hors des bornes SQL
+    parts = (value or "").split(":")
+    if len(parts) != len(types):
+        return None
+    values = []
+    for t, p in zip(types, parts):
+        if t is int:
+            v = parse_int(p)
+        else:
+            try:
+                v = t(p)
+            except ValueError:
+                return None
+            if not math.isfinite(v):
+                return None
+        if v is None:
+            return None
+        values.append(v)
+    return tuple(values)
+
+def _parse_time_cursor(value):
+    # "2026-01-01T10:00:00~123" -> (datetime, 123) ; None si le curseur est invalide
+    at, _, row_id = (value or "").rpartition("~")
+    row_id = parse_int(row_id)
+    try:
+        at = datetime.fromisoformat(at)
+    except ValueError:
+        return None
+    return (at, row_id) if row_id is not None else None
+
+def search_listings(db, city=None, country=None, guests=None, q=None, start=None, end=None,
+                    sort="recent", after=None, limit=None):
+    """Recherche paginée par curseur (keyset) : renvoie (annonces, curseur_suivant).
+
+    `sort` vaut "recent" (curseur "id") ou "rating" (curseur "note:id"), deux
+    ordres servis par un index, sans OFFSET.
+
+    Avec `start`/`end`, les annonces ayant une nuit occupée dans [start, end[
+    sont exclues par un anti-join sur le calendrier listing_nights.
+    """
+    limit = limit or current_app.config["SEARCH_PAGE_SIZE"]
+    query = db.query(Listing).options(*load_options("index"))
+
+    city, country = normalize_text(city), normalize_text(country)
+    if city:
+        query = query.filter(_prefix_filter(Listing.city_norm, city))
+    if country:
+        query = query.filter(_prefix_filter(Listing.country_norm, country))
+    if guests:
+        query = query.filter(Listing.max_guests >= guests)
+    if q and q.strip():
+        if fts_enabled():
+            match = _fts_query(q)
+            if match:
+                ids = (select(text("rowid")).select_from(text("listings_fts"))
+                       .where(text("listings_fts MATCH :match").bindparams(match=match)))
+                query = query.filter(Listing.id.in_(ids))
+        else:
+            pattern = f"%{q.strip()}%"
+            query = query.filter(or_(Listing.title.ilike(pattern), Listing.description.ilike(pattern),
+                                     Listing.amenities.ilike(pattern)))
+    if start and end and end > start:
+        query = query.filter(~exists().where(
+            ListingNight.listing_id == Listing.id, ListingNight.night >= start, ListingNight.night < end
+        ))
+    if sort == "rating":
+        cursor = _parse_cursor(after, float, int)
+        if cursor:
+            query = query.filter(tuple_(Listing.rating_avg, Listing.id) < cursor)
+        query = query.order_by(Listing.rating_avg.desc(), Listing.id.desc())
+        cursor_of = lambda l: f"{l.rating_avg!r}:{l.id}"
+    else:
+        cursor = _parse_cursor(after, int)
+        if cursor:
+            query = query.filter(Listing.id < cursor[0])
+        query = query.order_by(Listing.id.desc())
+        cursor_of = lambda l: str(l.id)
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = cursor_of(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def listing_reviews(db, listing_id, before=None, limit=None):
+    """Avis du plus récent au plus ancien, par pages (curseur "horodatage~id")."""
+    limit = limit or current_app.config["REVIEWS_PAGE_SIZE"]
+    query = db.query(Review).options(*load_options("listing_detail.reviews")).filter(Review.listing_id == listing_id)
+    cursor = _parse_time_cursor(before)
+    if cursor:
+        query = query.filter(tuple_(Review.created_at, Review.id) < cursor)
+    rows = query.order_by(Review.created_at.desc(), Review.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{last.created_at.isoformat()}~{last.id}"
+    return rows[:limit], next_cursor
+
+def find_conversation(db, a, b):
+    low, high = conversation_pair(a, b)
+    return db.query(Conversation).filter(Conversation.low_user_id == low, Conversation.high_user_id == high).first()
+
+def user_conversations(db, user_id, before=None, limit=None):
+    """Boîte de réception, conversation la plus récente d'abord (curseur "horodatage~id").
+
+    Un parcours par index (utilisateur côté low, puis côté high), chacun borné à
+    limit+1 lignes, fusionnés en Python : pas de OR qui forcerait un tri complet.
+    """
+    limit = limit or current_app.config["INBOX_PAGE_SIZE"]
+    cursor = _parse_time_cursor(before)
+    rows = []
+    for column in (Conversation.low_user_id, Conversation.high_user_id):
+        query = db.query(Conversation).options(*load_options("messages.inbox")).filter(
+            column == user_id, Conversation.last_message_at.isnot(None))
+        if cursor:
+            query = query.filter(tuple_(Conversation.last_message_at, Conversation.id) < cursor)
+        rows += query.order_by(Conversation.last_message_at.desc(), Conversation.id.desc()).limit(limit + 1).all()
+    rows.sort(key=lambda c: (c.last_message_at, c.id), reverse=True)
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{last.last_message_at.isoformat()}~{last.id}"
+    return rows[:limit], next_cursor
+
+def conversation_messages(db, conversation_id, before=None, limit=None):
+    """Dernière page de messages (curseur "id" pour les plus anciens), dans l'ordre chronologique."""
+    limit = limit or current_app.config["MESSAGES_PAGE_SIZE"]
+    query = db.query(Message).filter(Message.conversation_id == conversation_id)
+    cursor = _parse_cursor(before, int)
+    if cursor:
+        query = query.filter(Message.id < cursor[0])
+    rows = query.order_by(Message.id.desc()).limit(limit + 1).all()
+    next_cursor = str(rows[limit - 1].id) if len(rows) > limit else None
+    return rows[:limit][::-1], next_cursor
+
+def mark_conversation_read(conversation, user_id):
+    # Écriture seulement s'il y a des non-lus : rouvrir une conversation lue ne coûte rien.
+    # Transaction à part : un commit de la session expirerait les messages déjà chargés.
+    if conversation.unread_for(user_id):
+        c = Conversation.__table__.c
+        column = c.low_unread if user_id == conversation.low_user_id else c.high_unread
+        with database.engine.begin() as conn:
+            conn.execute(update(Conversation.__table__).where(c.id == conversation.id).values({column: 0}))
+
+def dashboard_data(db, user_id):
+    """Annonces de l'hôte, ses voyages et les réservations reçues (trois requêtes + chargements déclarés)."""
+    my_listings = db.query(Listing).options(*load_options("dashboard.my_listings")).filter(
+        Listing.host_id==user_id).all()
+    my_bookings = db.query(Booking).options(*load_options("dashboard.my_bookings")).filter(
+        Booking.user_id==user_id).order_by(Booking.created_at.desc()).all()
+    incoming = db.query(Booking).join(Booking.listing).options(*load_options("dashboard.incoming")).filter(
+        Listing.host_id==user_id).order_by(Booking.created_at.desc()).all()
+    return {"my_listings": my_listings, "my_bookings": my_bookings, "incoming": incoming}
+
+# Période affichée par /dashboard/analytics ; les mois acceptés laissent de la marge
+# à add_months de part et d'autre (sinon ValueError hors de date.min/date.max)
+REPORT_MAX_MONTHS = 120
+REPORT_MONTHS = (date(100, 1, 1), date(9998, 12, 1))
+
+def parse_month(value):
+    """AAAA-MM -> premier jour du mois ; None si absent, mal formé ou hors de REPORT_MONTHS."""
+    try:
+        month = datetime.strptime(value, "%Y-%m").date() if value else None
+    except ValueError:
+        return None
+    if month and not REPORT_MONTHS[0] <= month <= REPORT_MONTHS[1]:
+        return None
+    return month
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+def report_period(args):
+    """Mois demandés (start/end au format AAAA-MM, 12 derniers par défaut) -> [premier jour, fin[.
+
+    Valeurs invalides remplacées par les défauts ; au plus REPORT_MAX_MONTHS mois, les derniers.
+    """
+    end = parse_month(args.get("end")) or date.today().replace(day=1)
+    start = parse_month(args.get("start")) or add_months(end, -11)
+    if start > end:
+        start, end = end, start
+    start = max(start, add_months(end, 1 - REPORT_MAX_MONTHS))
+    return start, add_months(end, 1)
+
+def _rates(row, capacity):
+    # Taux d'occupation (nuits vendues / nuits offertes) et valeur moyenne d'une réservation
+    row["occupancy"] = row["nights"] / capacity if capacity else 0.0
+    row["average_value"] = row["booking_value"] / row["bookings"] if row["bookings"] else 0.0
+    return row
+
+def host_listing_count(db, host_id):
+    return db.query(func.count(Listing.id)).filter(Listing.host_id == host_id).scalar()
+
+def _daily_stats_query(host_id, start=None, end=None):
+    query = select(HostDailyStats).where(HostDailyStats.host_id == host_id)
+    if start:
+        query = query.where(HostDailyStats.day >= start)
+    if end:
+        query = query.where(HostDailyStats.day < end)
+    return query.order_by(HostDailyStats.day)
+
+def host_monthly_report(db, host_id, listing_count, start, end):
+    """Une ligne par mois de [start, end[, cumulée depuis les agrégats journaliers de l'hôte."""
+    months, month = {}, start
+    while month < end:
+        months[month] = {"month": month, "nights": 0, "revenue": 0.0, "bookings": 0, "booking_value": 0.0}
+        month = add_months(month, 1)
+    for stats in db.execute(_daily_stats_query(host_id, start, end)).scalars():
+        row = months[stats.day.replace(day=1)]
+        for col in STAT_COLUMNS:
+            row[col] += getattr(stats, col)
+    return [_rates(row, listing_count * (add_months(row["month"], 1) - row["month"]).days) for row in months.values()]
+
+def host_listing_report(db, host_id, start, end, limit=None):
+    """Annonces de l'hôte sur [start, end[, meilleur chiffre d'affaires d'abord (agrégats mensuels)."""
+    stats = ListingMonthlyStats
+    query = (select(Listing.id, Listing.title, Listing.city,
+                    *(func.sum(getattr(stats, col)).label(col) for col in STAT_COLUMNS))
+             .join(Listing, Listing.id == stats.listing_id)
+             .where(stats.host_id == host_id, stats.month >= start, stats.month < end)
+             .group_by(Listing.id, Listing.title, Listing.city)
+             .order_by(func.sum(stats.revenue).desc(), Listing.id))
+    if limit:
+        query = query.limit(limit)
+    days = (end - start).days
+    return [_rates(dict(row._mapping), days) for row in db.execute(query)]
+
+ANALYTICS_EXPORTS = {
+    "day": ("jour", "nuits", "chiffre_affaires", "reservations", "valeur_moyenne", "taux_occupation"),
+    "month": ("mois", "nuits", "chiffre_affaires", "reservations", "valeur_moyenne", "taux_occupation"),
+    "listing": ("mois", "annonce_id", "titre", "nuits", "chiffre_affaires", "reservations", "valeur_moyenne",
+                "taux_occupation"),
+}
+
+def _export_values(row):
+    return (row["nights"], round(row["revenue"], 2), row["bookings"], round(row["average_value"], 2),
+            round(row["occupancy"], 4))
+
+def analytics_rows(db, host_id, by, start=None, end=None, batch=1000):
+    """Lignes de l'export CSV, lues par lots dans l'ordre de l'index : mémoire constante."""
+    if by == "listing":
+        stats = ListingMonthlyStats
+        query = (select(stats, Listing.title).join(Listing, Listing.id == stats.listing_id)
+                 .where(stats.host_id == host_id).order_by(stats.listing_id, stats.month))
+        if start:
+            query = query.where(stats.month >= start)
+        if end:
+            query = query.where(stats.month < end)
+        for stats_row, title in db.execute(query.execution_options(yield_per=batch)):
+            row = {col: getattr(stats_row, col) for col in STAT_COLUMNS}
+            days = (add_months(stats_row.month, 1) - stats_row.month).days
+            yield (stats_row.month.strftime("%Y-%m"), stats_row.listing_id, title) + _export_values(_rates(row, days))
+        return
+    listing_count = host_listing_count(db, host_id)
+    days = db.execute(_daily_stats_query(host_id, start, end).execution_options(yield_per=batch)).scalars()
+    if by == "day":
+        for stats in days:
+            row = {col: getattr(stats, col) for col in STAT_COLUMNS}
+            yield (stats.day.isoformat(),) + _export_values(_rates(row, listing_count))
+        return
+    # Jours triés : un mois est complet dès que le suivant commence
+    current = None
+    for stats in days:
+        month = stats.day.replace(day=1)
+        if current is None or current["month"] != month:
+            if current is not None:
+                yield _month_export(current, listing_count)
+            current = {"month": month, "nights": 0, "revenue": 0.0, "bookings": 0, "booking_value": 0.0}
+        for col in STAT_COLUMNS:
+            current[col] += getattr(stats, col)
+    if current is not None:
+        yield _month_export(current, listing_count)
+
+def _month_export(row, listing_count):
+    days = (add_months(row["month"], 1) - row["month"]).days
+    return (row["month"].strftime("%Y-%m"),) + _export_values(_rates(row, listing_count * days))
+
+def csv_chunks(header, rows, chunk_rows=500):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % chunk_rows == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+def get_storage():
+    return current_app.extensions["storage"]
 
 def save_photo(file_storage):
+    """Enregistre un envoi sous un nom dérivé de son contenu ; renvoie (nom, sha256) ou None."""
     if not file_storage or file_storage.filename == "":
         return None
-    filename = secure_filename(file_storage.filename)
-    name, ext = os.path.splitext(filename)
-    ext = ext.lower()
-    if ext not in [".jpg",".jpeg",".png",".webp"]:
+    ext = os.path.splitext(secure_filename(file_storage.filename))[1].lower()
+    if ext not in images.EXTENSIONS:
         return None
-    unique = f"{name}_{int(datetime.utcnow().timestamp())}{ext}"
-    path = os.path.join(app.config["UPLOAD_FOLDER"], unique)
-    file_storage.save(path)
-    return unique
+    return images.store(file_storage.stream, get_storage(), ext)
+
+def known_dimensions(db, filename):
+    """Dimensions d'un fichier déjà décliné (même contenu envoyé plus tôt), sinon {}."""
+    photo = db.query(Photo).filter(Photo.filename == filename, Photo.thumb_width.isnot(None)).first()
+    return {name: getattr(photo, name) for name in PHOTO_DIMENSIONS} if photo else {}
+
+def process_photo(store, filename, workers=0):
+    """Génère les déclinaisons d'un fichier et enregistre leurs dimensions sur ses Photo.
+
+    Avec `workers`, le rendu passe par le pool de threads système d'images.submit
+    et seule l'écriture en base reste dans le thread (ou la greenlet) appelant.
+    """
+    try:
+        if workers:
+            dims = images.submit(images.render_variants, store, filename, workers=workers).result()
+        else:
+            dims = images.render_variants(store, filename)
+    except Exception as e:
+        print("Déclinaisons impossibles:", filename, "-", e)
+        return False
+    db = session_factory()
+    try:
+        for photo in db.query(Photo).filter(Photo.filename == filename):
+            for name, value in dims.items():
+                setattr(photo, name, value)
+        db.commit()
+    finally:
+        db.close()
+    return True
+
+# =========================================================
+# Mesures (durées par route, SQL, profilage ; voir instrumentation.py)
+# =========================================================
+perf = instrumentation.Instrumentation()
 
 # =========================================================
 # Routes
 # =========================================================
-@app.route("/")
-@app.route("/")
+@bp.route("/")
 def index():
-    q_city = request.args.get("city")
-    q_country = request.args.get("country")
-    q_guests = request.args.get("guests")
+    q_guests = request.args.get("guests", "")
+    dated = bool(request.args.get("start") and request.args.get("end"))
+
+    # Seuls les critères de recherche entrent dans la page (liens compris) et dans la clé :
+    # un paramètre inconnu ne peut pas se retrouver dans une page servie à d'autres
+    search_args = {k: v for k, v in request.args.items() if k in SEARCH_ARGS and v}
+    cacheable = page_cacheable()
+    if cacheable:
+        key = ("index", cache_versions.catalog, cache_versions.calendar if dated else 0,
+               tuple(sorted(search_args.items())))
+        cached = page_cache.get(key)
+        if cached:
+            return cached_response(*cached)
 
-    # On charge aussi les photos pour éviter DetachedInstanceError
-    listings = db.query(Listing).options(selectinload(Listing.photos))
+    db = read_session()
+    try:
+        # On charge aussi les photos pour éviter DetachedInstanceError
+        listings, next_cursor = search_listings(
+            db,
+            city=request.args.get("city"),
+            country=request.args.get("country"),
+            guests=parse_int(q_guests, minimum=1),
+            q=request.args.get("q"),
+            start=parse_date(request.args.get("start")),
+            end=parse_date(request.args.get("end")),
+            sort=request.args.get("sort", "recent"),
+            after=request.args.get("after"),
+        )
+        next_args = {k: v for k, v in search_args.items() if k != "after"}
+        filter_args = {k: v for k, v in next_args.items() if k != "sort"}
+        html = render_template("index.html", listings=listings, next_cursor=next_cursor,
+                               next_args=next_args, filter_args=filter_args)
+    finally:
+        db.close()
 
-    if q_city:
-        listings = listings.filter(Listing.city.ilike(f"%{q_city}%"))
-    if q_country:
-        listings = listings.filter(Listing.country.ilike(f"%{q_country}%"))
-    if q_guests and q_guests.isdigit():
-        listings = listings.filter(Listing.max_guests >= int(q_guests))
+    if not cacheable:
+        return html
+    entry = (html, datetime.utcnow().replace(microsecond=0), body_etag(html))
+    page_cache.set(key, entry)
+    return cached_response(*entry)
 
-    listings = listings.order_by(Listing.id.desc()).all()
 
-    return render_template("index.html", listings=listings)
+def throttle_wait(email=None):
+    """Secondes à attendre avant une nouvelle tentative (0 : elle passe), par IP puis par email."""
+    return ip_limiter.hit(request.remote_addr) or (email_limiter.hit(email) if email else 0)
 
+def auth_refused(template, form, wait):
+    # Refus sans hachage ni requête SQL : le coût d'une rafale reste négligeable
+    if wait:
+        flash(f"Trop de tentatives, réessaie dans {int(wait) + 1} s.", "warning")
+        status, retry = 429, int(wait) + 1
+    else:
+        flash("Service momentanément surchargé, réessaie dans un instant.", "warning")
+        status, retry = 503, 1
+    return render_template(template, form=form), status, {"Retry-After": str(retry)}
 
-@app.route("/register", methods=["GET","POST"])
+@bp.route("/register", methods=["GET","POST"])
 def register():
     form = RegisterForm()
     if form.validate_on_submit():
+        wait = throttle_wait()
+        if wait:
+            return auth_refused("register.html", form, wait)
         db = SessionLocal()
         try:
             if db.query(User).filter(User.email==form.email.data.lower()).first():
                 flash("Un compte existe déjà avec cet email.", "warning")
             else:
+                try:
+                    password_hash = credential_pool.run(hash_password, form.password.data)
+                except security.ServiceBusy:
+                    return auth_refused("register.html", form, 0)
                 user = User(
                     name=form.name.data,
                     email=form.email.data.lower(),
-                    password_hash=generate_password_hash(form.password.data)
+                    password_hash=password_hash
                 )
                 db.add(user); db.commit()
                 login_user(user)
                 flash("Bienvenue ! Ton compte est créé.", "success")
-                return redirect(url_for("index"))
+                return redirect(url_for(".index"))
         finally:
             db.close()
     return render_template("register.html", form=form)
 
-@app.route("/login", methods=["GET","POST"])
+@bp.route("/login", methods=["GET","POST"])
 def login():
     form = LoginForm()
     if form.validate_on_submit():
+        email = form.email.data.lower()
+        wait = throttle_wait(email)
+        if wait:
+            return auth_refused("login.html", form, wait)
         db = SessionLocal()
         try:
-            user = db.query(User).filter(User.email==form.email.data.lower()).first()
-            if user and check_password_hash(user.password_hash, form.password.data):
+            user = db.query(User).filter(User.email==email).first()
+            try:
+                valid = user is not None and credential_pool.run(passwords.verify, user.password_hash, form.password.data)
+                if valid and passwords.needs_rehash(user.password_hash):
+                    # Coût ou méthode changés depuis la création du hash : on profite du mot de passe en clair
+                    user.password_hash = credential_pool.run(hash_password, form.password.data)
+                    db.commit()
+            except security.ServiceBusy:
+                return auth_refused("login.html", form, 0)
+            if valid:
                 login_user(user)
                 flash("Connecté.", "success")
-                return redirect(url_for("index"))
+                return redirect(url_for(".index"))
             else:
                 flash("Identifiants invalides.", "danger")
         finally:
             db.close()
     return render_template("login.html", form=form)
 
-@app.route("/logout")
+@bp.route("/logout")
 @login_required
 def logout():
     logout_user()
     flash("Déconnecté.", "info")
-    return redirect(url_for("index"))
+    return redirect(url_for(".index"))
 
-@app.route("/listings/new", methods=["GET","POST"])
+@bp.route("/listings/new", methods=["GET","POST"])
 @login_required
 def new_listing():
     form = ListingForm()
@@ -339,55 +1817,65 @@ def new_listing():
                 amenities=form.amenities.data or ""
             )
             db.add(listing); db.commit()
+            pending = set()
             for ph in [form.photo1.data, form.photo2.data]:
-                fn = save_photo(ph)
-                if fn:
-                    db.add(Photo(listing_id=listing.id, filename=fn))
+                saved = save_photo(ph)
+                if saved:
+                    fn, digest = saved
+                    dims = known_dimensions(db, fn)
+                    db.add(Photo(listing_id=listing.id, filename=fn, content_hash=digest, **dims))
+                    if not dims:
+                        pending.add(fn)
             db.commit()
+            # Vignettes générées en arrière-plan ; l'original est servi en attendant. Sous
+            # gevent ce thread est une greenlet qui attend le rendu sans bloquer le worker.
+            for fn in pending:
+                threading.Thread(target=process_photo, daemon=True, name="photo",
+                                 args=(get_storage(), fn, current_app.config["IMAGE_WORKERS"])).start()
             flash("Annonce publiée.", "success")
-            return redirect(url_for("listing_detail", listing_id=listing.id))
+            return redirect(url_for(".listing_detail", listing_id=listing.id))
         finally:
             db.close()
     return render_template("new_listing.html", form=form)
 
-@app.route("/listings/<int:listing_id>", methods=["GET","POST"])
+@bp.route("/listings/<int:listing_id>", methods=["GET","POST"])
 def listing_detail(listing_id):
-    db = SessionLocal()
+    db = read_session()
     try:
+        # Photos et avis ne sont chargés que si le fragment de la fiche n'est pas en cache
         listing = db.get(Listing, listing_id)
         if not listing:
             flash("Annonce introuvable.", "warning")
-            return redirect(url_for("index"))
+            return redirect(url_for(".index"))
         bform = BookingForm()
         rform = ReviewForm()
+        if request.method == "GET":
+            # Dates reprises de la recherche
+            bform.start_date.data = bform.start_date.data or parse_date(request.args.get("start"))
+            bform.end_date.data = bform.end_date.data or parse_date(request.args.get("end"))
 
         if bform.submit.data and bform.validate_on_submit():
             start = bform.start_date.data
             end = bform.end_date.data
             guests = bform.guests.data
-            if end < start:
+            if end <= start:
                 flash("La date de départ doit être après l'arrivée.", "warning")
             elif guests > listing.max_guests:
                 flash("Nombre de voyageurs supérieur à la capacité.", "warning")
             elif not current_user.is_authenticated:
                 flash("Connecte-toi pour réserver.", "warning")
-                return redirect(url_for("login"))
-            elif not listing_available(db, listing.id, start, end):
+                return redirect(url_for(".login"))
+            elif book_listing(listing.id, current_user.id, start, end, guests, listing.price_per_night) is None:
+                # Vérifié sous verrou d'écriture : seule source de vérité, jamais l'index en mémoire
                 flash("Ces dates ne sont pas disponibles.", "warning")
             else:
-                nights = (end - start).days or 1
-                total = nights * listing.price_per_night
-                booking = Booking(user_id=current_user.id, listing_id=listing.id,
-                                  start_date=start, end_date=end, guests=guests,
-                                  total_price=total, status="confirmed")
-                db.add(booking); db.commit()
                 flash("Réservation créée (paiement simulé).", "success")
-                return redirect(url_for("dashboard"))
+                return redirect(url_for(".dashboard"))
 
         if rform.submit.data and rform.validate_on_submit():
             if not current_user.is_authenticated:
                 flash("Connecte-toi pour publier un avis.", "warning")
-                return redirect(url_for("login"))
+                return redirect(url_for(".login"))
             past_booking = db.query(Booking).filter(
                 Booking.user_id==current_user.id,
                 Booking.listing_id==listing.id,
@@ -401,26 +1889,102 @@ def listing_detail(listing_id):
                                 rating=rform.rating.data, comment=rform.comment.data)
                 db.add(review); db.commit()
                 flash("Avis publié.", "success")
-                return redirect(url_for("listing_detail", listing_id=listing.id))
+                return redirect(url_for(".listing_detail", listing_id=listing.id))
 
-        reviews = db.query(Review).filter(Review.listing_id==listing.id).order_by(Review.created_at.desc()).all()
-        return render_template("listing_detail.html", listing=listing, bform=bform, rform=rform, reviews=reviews)
+        def render_body():
+            reviews, reviews_cursor = listing_reviews(db, listing.id, before=request.args.get("reviews_before"))
+            return render_template("_listing_body.html", listing=listing, reviews=reviews, reviews_cursor=reviews_cursor)
+
+        key = ("listing", listing.id, cache_versions.listing(listing.id), request.args.get("reviews_before"))
+        body = Markup(fragment_cache.get_or_set(key, render_body))
+        html = render_template("listing_detail.html", listing=listing, bform=bform, rform=rform, body=body)
+        if request.method != "GET":
+            return html
+        # Page propre à la session (jeton CSRF des formulaires) : ni ETag ni Last-Modified,
+        # un 304 rejouerait un jeton périmé. Le corps, lui, vient du cache de fragments.
+        resp = make_response(html)
+        resp.cache_control.private = True
+        resp.cache_control.no_store = True
+        return resp
     finally:
         db.close()
 
-@app.route("/dashboard")
+AVAILABILITY_MAX_IDS = 100
+
+@bp.route("/api/availability")
+def api_availability():
+    """Annonces libres sur [start, end[ parmi `ids` (séparés par des virgules)."""
+    start, end = parse_date(request.args.get("start")), parse_date(request.args.get("end"))
+    ids = {parse_int(i, minimum=1) for i in request.args.get("ids", "").split(",") if i.strip()}
+    if not start or not end or end <= start or not ids or None in ids or len(ids) > AVAILABILITY_MAX_IDS:
+        abort(400)
+    db = read_session()
+    try:
+        existing = set(db.scalars(select(Listing.id).where(Listing.id.in_(ids))))
+        free = available_listing_ids(db, existing, start, end)
+    finally:
+        db.close()
+    return {"start": start.isoformat(), "end": end.isoformat(), "available": sorted(free)}
+
+@bp.route("/dashboard")
 @login_required
 def dashboard():
-    db = SessionLocal()
+    db = read_session()
+    try:
+        return render_template("dashboard.html", **dashboard_data(db, current_user.id))
+    finally:
+        db.close()
+
+@bp.route("/dashboard/analytics")
+@login_required
+def analytics():
+    start, end = report_period(request.args)
+    db = read_session()
     try:
-        my_listings = db.query(Listing).filter(Listing.host_id==current_user.id).all()
-        my_bookings = db.query(Booking).filter(Booking.user_id==current_user.id).order_by(Booking.created_at.desc()).all()
-        incoming = db.query(Booking).join(Listing).filter(Listing.host_id==current_user.id).order_by(Booking.created_at.desc()).all()
-        return render_template("dashboard.html", my_listings=my_listings, my_bookings=my_bookings, incoming=incoming)
+        listing_count = host_listing_count(db, current_user.id)
+        months = host_monthly_report(db, current_user.id, listing_count, start, end)
+        listings = host_listing_report(db, current_user.id, start, end, current_app.config["ANALYTICS_TOP_LISTINGS"])
     finally:
         db.close()
+    totals = {col: sum(m[col] for m in months) for col in STAT_COLUMNS}
+    _rates(totals, listing_count * (end - start).days)
+    return render_template("analytics.html", months=months, listings=listings, totals=totals,
+                           listing_count=listing_count, start=start, last=add_months(end, -1))
 
-@app.route("/messages/<int:receiver_id>", methods=["GET","POST"])
+@bp.route("/dashboard/analytics.csv")
+@login_required
+def analytics_csv():
+    """Export CSV diffusé au fil de la lecture (tout l'historique par défaut)."""
+    by = request.args.get("by", "month")
+    if by not in ANALYTICS_EXPORTS:
+        abort(400)
+    start = parse_month(request.args.get("start"))
+    end = parse_month(request.args.get("end"))
+    end = add_months(end, 1) if end else None
+    host_id = current_user.id
+
+    def generate():
+        db = read_session()
+        try:
+            yield from csv_chunks(ANALYTICS_EXPORTS[by], analytics_rows(db, host_id, by, start, end))
+        finally:
+            db.close()
+
+    filename = f"staybnb-{by}-{date.today().isoformat()}.csv"
+    return Response(stream_with_context(generate()), mimetype="text/csv",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@bp.route("/messages")
+@login_required
+def inbox():
+    db = read_session()
+    try:
+        conversations, next_cursor = user_conversations(db, current_user.id, request.args.get("before"))
+        return render_template("inbox.html", conversations=conversations, next_cursor=next_cursor)
+    finally:
+        db.close()
+
+@bp.route("/messages/<int:receiver_id>", methods=["GET","POST"])
 @login_required
 def messages(receiver_id):
     db = SessionLocal()
@@ -428,29 +1992,202 @@ def messages(receiver_id):
         other = db.get(User, receiver_id)
         if not other:
             flash("Utilisateur introuvable.", "warning")
-            return redirect(url_for("index"))
+            return redirect(url_for(".index"))
+        if other.id == current_user.id:
+            return redirect(url_for(".inbox"))
         form = MessageForm()
         if form.validate_on_submit():
             m = Message(sender_id=current_user.id, receiver_id=other.id, body=form.body.data)
             db.add(m); db.commit()
-            return redirect(url_for("messages", receiver_id=other.id))
-        convo = db.query(Message).filter(
-            or_(
-                and_(Message.sender_id==current_user.id, Message.receiver_id==other.id),
-                and_(Message.sender_id==other.id, Message.receiver_id==current_user.id),
-            )
-        ).order_by(Message.created_at.asc()).all()
-        return render_template("messages.html", other=other, messages=convo, form=form)
+            return redirect(url_for(".messages", receiver_id=other.id))
+        convo, older = [], None
+        conversation = find_conversation(db, current_user.id, other.id)
+        if conversation:
+            before = request.args.get("before")
+            convo, older = conversation_messages(db, conversation.id, before)
+            if not before:
+                mark_conversation_read(conversation, current_user.id)
+        return render_template("messages.html", other=other, messages=convo, older_cursor=older, form=form)
     finally:
         db.close()
 
-@app.route("/uploads/<path:filename>")
+@bp.route("/metrics")
+def metrics():
+    lines = []
+    for name, kind, help_text in (
+        ("hits", "counter", "Lectures servies par le cache"),
+        ("misses", "counter", "Lectures absentes ou expirées"),
+        ("evictions", "counter", "Entrées évincées (LRU ou expiration)"),
+    ):
+        lines.append(f"# HELP staybnb_cache_{name}_total {help_text}")
+        lines.append(f"# TYPE staybnb_cache_{name}_total {kind}")
+        for cache in (page_cache, fragment_cache, user_cache):
+            lines.append(f'staybnb_cache_{name}_total{{cache="{cache.name}"}} {getattr(cache, name)}')
+    lines.append("# HELP staybnb_cache_entries Entrées actuellement en cache")
+    lines.append("# TYPE staybnb_cache_entries gauge")
+    for cache in (page_cache, fragment_cache, user_cache):
+        lines.append(f'staybnb_cache_entries{{cache="{cache.name}"}} {len(cache)}')
+    lines.append("# HELP staybnb_auth_throttled_total Tentatives de connexion refusées (429) par limite")
+    lines.append("# TYPE staybnb_auth_throttled_total counter")
+    for limiter in (ip_limiter, email_limiter):
+        lines.append(f'staybnb_auth_throttled_total{{key="{limiter.name}"}} {limiter.rejected}')
+    lines.append("# HELP staybnb_auth_busy_total Vérifications refusées (503), pool de hachage saturé")
+    lines.append("# TYPE staybnb_auth_busy_total counter")
+    lines.append(f"staybnb_auth_busy_total {credential_pool.rejected}")
+    lines.extend(perf.render())
+    lines.append("# HELP staybnb_sse_connections Connexions /events ouvertes dans ce processus")
+    lines.append("# TYPE staybnb_sse_connections gauge")
+    lines.append(f"staybnb_sse_connections {len(broker)}")
+    return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@bp.route("/events")
+@login_required
+def events():
+    """Flux SSE des nouveaux messages et réservations de l'utilisateur connecté."""
+    user_id = current_user.id
+    heartbeat = current_app.config["EVENTS_HEARTBEAT_SECONDS"]
+
+    def stream():
+        # Abonnement pris au premier tour du générateur : si la réponse n'est jamais
+        # lue (client parti avant), il n'y a rien à désabonner
+        subscription = broker.subscribe(user_id)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                item = subscription.get(timeout=heartbeat)
+                if item is None:
+                    # Commentaire SSE : garde la connexion ouverte et détecte les clients partis
+                    yield ": ping\n\n"
+                    continue
+                event_name, data = item
+                yield f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@bp.route("/uploads/<path:filename>")
 def uploads(filename):
-    return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+    store = get_storage()
+    if not store.local:
+        # Bucket privé : redirection vers une URL signée, gardée moins longtemps qu'elle n'est valide
+        resp = redirect(store.presigned_url(filename))
+        resp.cache_control.private = True
+        resp.cache_control.max_age = current_app.config["S3_PRESIGN_SECONDS"] // 2
+        return resp
+    path = store.local_path(filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    immutable = storage.is_immutable(filename)
+    if current_app.config["UPLOADS_OFFLOAD"] == "x-accel":
+        # nginx envoie le fichier (sendfile, Range, If-None-Match) ; le worker est libéré aussitôt
+        resp = make_response("")
+        resp.headers["X-Accel-Redirect"] = current_app.config["UPLOADS_ACCEL_PREFIX"] + quote(filename)
+        resp.headers["Content-Type"] = storage.content_type(filename)
+        resp.headers["Cache-Control"] = storage.cache_control(filename, current_app.config["UPLOADS_MAX_AGE"])
+        return resp
+    # ETag/Last-Modified (304) et Range (206) par Werkzeug ; X-Sendfile si USE_X_SENDFILE,
+    # sinon wsgi.file_wrapper, que gunicorn sert par sendfile() sans copie en Python
+    resp = send_file(path, conditional=True, etag=True,
+                     max_age=storage.IMMUTABLE_MAX_AGE if immutable else current_app.config["UPLOADS_MAX_AGE"])
+    resp.cache_control.public = True
+    resp.cache_control.immutable = immutable or None
+    return resp
+
+# =========================================================
+# Commandes (flask --app app ...)
+# =========================================================
+@bp.cli.command("init-db")
+def init_db_command():
+    """Crée les tables et index, et met à niveau une base existante."""
+    init_schema()
+    click.echo("Schéma à jour.")
+
+@bp.cli.command("process-photos")
+@click.option("--workers", default=4, show_default=True, help="Threads de redimensionnement.")
+def process_photos_command(workers):
+    """Génère les déclinaisons manquantes (photos envoyées avant le pipeline d'images)."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    db = session_factory()
+    try:
+        filenames = [fn for (fn,) in db.query(Photo.filename).filter(Photo.thumb_width.is_(None)).distinct()]
+    finally:
+        db.close()
+    store = get_storage()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        done = sum(pool.map(lambda fn: process_photo(store, fn), filenames))
+    click.echo(f"{done}/{len(filenames)} fichiers déclinés.")
+
+@bp.cli.command("seed")
+@click.option("--fixtures", "fixtures_dir", type=click.Path(exists=True, file_okay=False),
+              help="Dossier local (listings.jsonl + photos) ; fixtures/demo par défaut si le réseau manque.")
+@click.option("--skip-photos", is_flag=True, help="Ne pas récupérer les photos.")
+@click.option("--workers", default=8, show_default=True, help="Téléchargements de photos en parallèle.")
+def seed_command(fixtures_dir, skip_photos, workers):
+    """Crée les annonces de démo si la base est vide."""
+    from importer import seed_demo
+    seed_demo(fixtures_dir, skip_photos=skip_photos, workers=workers)
+
+@bp.cli.command("import-listings")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), help="Déduit de l'extension par défaut.")
+@click.option("--host-email", default="demo@staybnb.local", show_default=True,
+              help="Hôte des annonces sans colonne host_email (créé si besoin).")
+@click.option("--batch-size", default=2000, show_default=True)
+@click.option("--workers", default=8, show_default=True, help="Téléchargements/copies de photos en parallèle.")
+@click.option("--photos-dir", type=click.Path(exists=True, file_okay=False),
+              help="Dossier des photos en chemins relatifs (défaut : dossier du fichier).")
+@click.option("--skip-photos", is_flag=True)
+def import_listings_command(path, fmt, host_email, batch_size, workers, photos_dir, skip_photos):
+    """Importe un catalogue d'annonces CSV ou JSONL, en flux et par lots."""
+    from importer import import_records, read_records
+    n_listings, n_photos, elapsed = import_records(
+        read_records(path, fmt), host_email, batch_size=batch_size, workers=workers,
+        photos_dir=photos_dir or os.path.dirname(os.path.abspath(path)), skip_photos=skip_photos,
+    )
+    click.echo(f"{n_listings} annonces et {n_photos} photos en {elapsed:.1f}s "
+               f"({n_listings / max(elapsed, 1e-9):.0f} annonces/s)")
+
+# =========================================================
+# App factory
+# =========================================================
+def create_app(config=None):
+    """Construit l'application. Aucune connexion ni écriture disque ici : le
+    schéma se crée avec `flask init-db`, les données de démo avec `flask seed`."""
+    app = Flask(__name__)
+    app.config.update(config_from_env())
+    app.config.update(config or {})
+
+    database.init_app(app)
+    login_manager.init_app(app)
+    perf.init_app(app)
+    app.extensions["storage"] = storage.make_storage(app.config)
+    broker.init_app(app)
+    if broker.relay:
+        # Invalidations des autres workers reçues dès la première requête, SSE ou non
+        app.before_request(broker.start)
+    app.config["USE_X_SENDFILE"] = app.config["UPLOADS_OFFLOAD"] == "x-sendfile"
+    if app.config["TRUSTED_PROXIES"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"], x_proto=app.config["TRUSTED_PROXIES"])
+    passwords.method = app.config["PASSWORD_HASH_METHOD"]
+    credential_pool.configure(app.config["AUTH_WORKERS"], app.config["AUTH_MAX_PENDING"])
+    for limiter, prefix in ((ip_limiter, "LOGIN_IP"), (email_limiter, "LOGIN_EMAIL")):
+        limiter.capacity, limiter.per_minute = app.config[f"{prefix}_BURST"], app.config[f"{prefix}_PER_MINUTE"]
+        limiter.clear()
+    for cache, prefix in ((page_cache, "PAGE_CACHE"), (fragment_cache, "FRAGMENT_CACHE"), (user_cache, "USER_CACHE")):
+        cache.max_size, cache.ttl = app.config[f"{prefix}_SIZE"], app.config[f"{prefix}_TTL"]
+        cache.clear()
+    availability.max_size = app.config["AVAILABILITY_CACHE_SIZE"]
+    availability.ttl = app.config["AVAILABILITY_CACHE_TTL"]
+    availability.invalidate()
+    app.register_blueprint(bp)
+    return app
 
 # =========================================================
 # Run
 # =========================================================
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    app.run(debug=False, host="0.0.0.0", port=port)
+    create_app().run(debug=False, host="0.0.0.0", port=port)
@@ -0,0 +1 @@
+# Scripts de mesure de performance (lancés à la main, hors de l'application)
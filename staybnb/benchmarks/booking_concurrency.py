@@ -0,0 +1,113 @@
+"""Test de charge des réservations concurrentes.
+
+Plusieurs processus (comme des workers gunicorn), chacun avec plusieurs
+threads, réservent en boucle des séjours qui se chevauchent sur quelques
+annonces, dans une base SQLite temporaire. On affiche le débit et on vérifie
+qu'aucune nuit n'a été réservée deux fois.
+
+    python -m benchmarks.booking_concurrency --processes 4 --threads 8 --attempts 50
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _worker(args):
+    worker_id, threads, attempts, listing_ids, user_ids, horizon = args
+    import threading
+    import app as staybnb
+
+    flask_app = staybnb.create_app()
+    counts = {"ok": 0, "unavailable": 0, "error": 0}
+    lock = threading.Lock()
+
+    def run(seed):
+        rng = random.Random(seed)
+        with flask_app.app_context():
+            book(rng)
+
+    def book(rng):
+        for _ in range(attempts):
+            start = date.today() + timedelta(days=rng.randrange(horizon))
+            end = start + timedelta(days=rng.randint(1, 7))
+            try:
+                booking = staybnb.book_listing(rng.choice(listing_ids), rng.choice(user_ids), start, end, 1, 100.0)
+                key = "unavailable" if booking is None else "ok"
+            except Exception as e:
+                print(f"[worker {worker_id}] {e!r}", file=sys.stderr)
+                key = "error"
+            with lock:
+                counts[key] += 1
+
+    pool = [threading.Thread(target=run, args=(worker_id * 1000 + i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--attempts", type=int, default=50, help="réservations tentées par thread")
+    parser.add_argument("--listings", type=int, default=3)
+    parser.add_argument("--horizon", type=int, default=120, help="fenêtre de dates en jours")
+    opts = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="staybnb-bench-")
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tmpdir, "bench.sqlite3")
+    import app as staybnb
+
+    staybnb.create_app().app_context().push()
+    staybnb.init_schema()
+    db = staybnb.session_factory()
+    try:
+        users = [staybnb.User(name=f"Guest {i}", email=f"guest{i}@bench.local", password_hash="x") for i in range(20)]
+        db.add_all(users)
+        db.flush()
+        listings = [staybnb.Listing(host_id=users[0].id, title=f"Bench {i}", description="Annonce de test de charge",
+                                    city="Paris", country="France", price_per_night=100.0, max_guests=2,
+                                    bedrooms=1, bathrooms=1) for i in range(opts.listings)]
+        db.add_all(listings)
+        db.commit()
+        listing_ids, user_ids = [l.id for l in listings], [u.id for u in users]
+    finally:
+        db.close()
+    staybnb.database.dispose()
+
+    jobs = [(w, opts.threads, opts.attempts, listing_ids, user_ids, opts.horizon) for w in range(opts.processes)]
+    started = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(opts.processes) as pool:
+        results = pool.map(_worker, jobs)
+    elapsed = time.perf_counter() - started
+
+    totals = {k: sum(r[k] for r in results) for k in ("ok", "unavailable", "error")}
+    attempts = sum(totals.values())
+
+    with staybnb.database.engine.connect() as conn:
+        double_booked = conn.exec_driver_sql(
+            "SELECT COUNT(*) FROM bookings a JOIN bookings b "
+            "ON a.listing_id = b.listing_id AND a.id < b.id "
+            "AND a.start_date < b.end_date AND b.start_date < a.end_date "
+            "WHERE a.status IN ('pending','confirmed','paid') AND b.status IN ('pending','confirmed','paid') "
+            "AND a.listing_id IN (%s)" % ",".join(map(str, listing_ids))
+        ).scalar()
+
+    print(f"{opts.processes} processus x {opts.threads} threads, {attempts} tentatives en {elapsed:.2f}s")
+    print(f"  {attempts / elapsed:.0f} tentatives/s, {totals['ok'] / elapsed:.0f} réservations/s")
+    print(f"  créées={totals['ok']} refusées={totals['unavailable']} erreurs={totals['error']}")
+    print(f"  doubles réservations={double_booked}")
+    return 1 if double_booked or totals["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""Compare deux fichiers de résultats (micro ou load) : écarts de p50/p95 par cas.
+
+Code de sortie 1 si un cas mesuré dans les deux fichiers ralentit de plus de
+`--threshold` % sur p95 (ou sur p50 avec `--metric p50_ms`) : à lancer après
+une modification, contre un résultat de référence pris avant.
+
+    python -m benchmarks.compare avant.json apres.json --threshold 15
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.results import cell
+
+
+def _load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _delta(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10, help="ralentissement toléré, en %%")
+    parser.add_argument("--metric", default="p95_ms", choices=("p50_ms", "p95_ms", "p99_ms", "mean_ms"))
+    parser.add_argument("--min-ms", type=float, default=0.5,
+                        help="écarts ignorés sous cette durée (bruit de mesure)")
+    opts = parser.parse_args()
+
+    before, after = _load(opts.before), _load(opts.after)
+    if before["kind"] != after["kind"]:
+        print(f"Fichiers de natures différentes : {before['kind']} / {after['kind']}")
+        return 2
+    print(f"avant : {before['created_at']} (commit {before['commit']})")
+    print(f"après : {after['created_at']} (commit {after['commit']})")
+
+    regressions = 0
+    for size, cases in after["sizes"].items():
+        reference = before["sizes"].get(size)
+        if reference is None:
+            continue
+        print(f"\n{size} annonces")
+        print(f"  {'cas':<32} {'p50 avant':>10} {'après':>9} {'écart':>8} {'p95 avant':>10} {'après':>9} {'écart':>8}")
+        for name, stats in cases.items():
+            old = reference.get(name)
+            if old is None:
+                continue
+            line = f"  {name:<32}"
+            for metric in ("p50_ms", "p95_ms"):
+                delta = _delta(old.get(metric), stats.get(metric))
+                line += (f" {cell(old.get(metric)):>10} {cell(stats.get(metric)):>9}"
+                         f" {'' if delta is None else f'{delta:+.0f}%':>8}")
+            delta = _delta(old.get(opts.metric), stats.get(opts.metric))
+            slower = (delta is not None and delta > opts.threshold
+                      and stats[opts.metric] - old[opts.metric] >= opts.min_ms)
+            if slower:
+                regressions += 1
+                line += "  RÉGRESSION"
+            print(line)
+    print(f"\n{regressions} régression(s) au-delà de {opts.threshold:.0f}% sur {opts.metric}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
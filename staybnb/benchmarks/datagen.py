@@ -0,0 +1,271 @@
+"""Génération déterministe d'une base de test réaliste.
+
+Utilisateurs, annonces, photos, réservations, avis et messages, avec les
+déséquilibres d'une vraie plateforme : quelques villes concentrent l'offre,
+quelques hôtes professionnels gèrent des centaines d'annonces, certaines
+annonces sont très demandées et certains voyageurs réservent souvent.
+
+Même graine et même taille -> mêmes données ; les dates sont relatives au jour
+de génération (`anchor`, noté dans le manifeste `<base>.json`). Les données
+dérivées (calendrier, notes moyennes, conversations, index FTS) sont ensuite
+calculées par init_schema(), comme pour une base existante mise à niveau.
+
+Les bases générées sont gardées dans `--data-dir` et réutilisées par les
+autres scripts (micro-benchmarks, charge HTTP) : 1M d'annonces prend plusieurs
+minutes à générer.
+
+    python -m benchmarks.datagen --listings 100000 --seed 1
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from bisect import bisect
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "staybnb-bench")
+PASSWORD = "bench1234"
+
+# Par ordre de popularité (loi de Zipf sur le rang)
+CITIES = [
+    ("Paris", "France"), ("Barcelone", "Espagne"), ("Lisbonne", "Portugal"), ("Rome", "Italie"),
+    ("Londres", "Royaume-Uni"), ("Nice", "France"), ("Marseille", "France"), ("Amsterdam", "Pays-Bas"),
+    ("Lyon", "France"), ("Berlin", "Allemagne"), ("Madrid", "Espagne"), ("Porto", "Portugal"),
+    ("Bordeaux", "France"), ("Florence", "Italie"), ("Montréal", "Canada"), ("Prague", "Tchéquie"),
+    ("Venise", "Italie"), ("Séville", "Espagne"), ("Bruxelles", "Belgique"), ("Vienne", "Autriche"),
+    ("Marrakech", "Maroc"), ("Montpellier", "France"), ("Biarritz", "France"), ("Annecy", "France"),
+    ("Toulouse", "France"), ("Nantes", "France"), ("Lille", "France"), ("Strasbourg", "France"),
+    ("Genève", "Suisse"), ("Dublin", "Irlande"), ("Édimbourg", "Royaume-Uni"), ("Munich", "Allemagne"),
+    ("Québec", "Canada"), ("Milan", "Italie"), ("Saint-Malo", "France"), ("Chamonix", "France"),
+    ("Ajaccio", "France"), ("Arcachon", "France"), ("Colmar", "France"), ("Dakar", "Sénégal"),
+]
+KINDS = ["Studio", "Appartement", "Loft", "Maison", "Villa", "Chambre", "Cabane", "Duplex"]
+QUALIFIERS = ["lumineux", "cosy", "avec vue mer", "avec jardin", "au calme", "design", "familial",
+              "en centre-ville", "avec terrasse", "rénové", "avec piscine", "près de la plage"]
+AMENITIES = ["Wi-Fi", "Cuisine", "Lave-linge", "Climatisation", "Parking", "Piscine", "Balcon",
+             "Cheminée", "Jardin", "Télévision", "Ascenseur", "Animaux acceptés"]
+SENTENCES = [
+    "Idéal pour un séjour en couple ou en famille.", "À deux pas des commerces et des transports.",
+    "Literie neuve et linge fourni.", "Vue dégagée sur les toits de la ville.",
+    "Quartier animé le soir, calme la nuit.", "Parfait pour le télétravail avec une connexion rapide.",
+    "Grande pièce de vie ouverte sur la cuisine équipée.", "Arrivée autonome avec boîte à clés.",
+    "Plage accessible à pied en dix minutes.", "Petit déjeuner possible sur demande.",
+]
+FIRST_NAMES = ["Camille", "Louis", "Emma", "Hugo", "Léa", "Lucas", "Chloé", "Jules", "Manon", "Arthur",
+               "Inès", "Nathan", "Sarah", "Gabriel", "Jade", "Adam", "Alice", "Raphaël", "Lina", "Paul"]
+COMMENTS = ["Séjour parfait, je recommande.", "Très bien situé, hôte réactif.", "Propre et conforme aux photos.",
+            "Un peu bruyant mais pratique.", "Décevant, le logement n'était pas prêt.", "Superbe vue, on reviendra !"]
+CHAT = ["Bonjour, le logement est-il disponible ?", "Oui, avec plaisir !", "À quelle heure peut-on arriver ?",
+        "À partir de 16h, la boîte à clés est à l'entrée.", "Merci beaucoup !", "Bon séjour !"]
+# Statuts : les annulées ne bloquent pas le calendrier
+STATUSES = ["confirmed", "paid", "pending", "cancelled"]
+STATUS_WEIGHTS = [60, 15, 10, 15]
+NIGHTS = list(range(1, 15))
+NIGHT_WEIGHTS = [14, 18, 16, 12, 9, 7, 10, 3, 2, 2, 1, 1, 1, 4]
+RATINGS = [1, 2, 3, 4, 5]
+RATING_WEIGHTS = [2, 3, 10, 35, 50]
+PAST_DAYS, FUTURE_DAYS = 365, 180
+
+
+class Zipf:
+    """Tirage d'un rang dans [0, n[ avec une probabilité en 1 / (rang + 1) ** s."""
+
+    def __init__(self, rng, n, s):
+        self.rng = rng
+        self.cum = list(accumulate(1 / (k + 1) ** s for k in range(n)))
+
+    def __call__(self):
+        return bisect(self.cum, self.rng.random() * self.cum[-1])
+
+
+def database_path(listings, seed, data_dir=DEFAULT_DATA_DIR):
+    return os.path.join(data_dir, f"bench-{listings}-s{seed}.sqlite3")
+
+
+def load_manifest(path):
+    try:
+        with open(path + ".json", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _host_sizes(rng, listings):
+    # Annonces par hôte : loi de Pareto, plafonnée (grands gestionnaires de biens)
+    cap = max(50, listings // 200)
+    sizes = []
+    remaining = listings
+    while remaining:
+        n = min(remaining, cap, int(rng.paretovariate(1.3)))
+        sizes.append(n)
+        remaining -= n
+    return sizes
+
+
+def _photo_name(seed, listing_id, i):
+    return hashlib.sha256(f"{seed}:{listing_id}:{i}".encode()).hexdigest()[:32] + ".jpg"
+
+
+def generate(staybnb, listings, seed=1, anchor=None, bookings_per_listing=4, batch_size=5000, log=print):
+    """Remplit la base (vide) de l'application courante ; renvoie les effectifs générés."""
+    from sqlalchemy import insert
+
+    rng = random.Random(seed)
+    anchor = anchor or date.today()
+    engine = staybnb.database.engine
+    staybnb.Base.metadata.create_all(engine)
+    started = time.perf_counter()
+
+    host_sizes = _host_sizes(rng, listings)
+    hosts, guests = len(host_sizes), max(10, listings)
+    password_hash = staybnb.hash_password(PASSWORD)
+    counts = {"users": hosts + guests, "hosts": hosts, "listings": listings,
+              "photos": 0, "bookings": 0, "reviews": 0, "messages": 0}
+
+    with engine.begin() as conn:
+        for first in range(0, hosts + guests, batch_size):
+            conn.execute(insert(staybnb.User), [
+                {"id": uid, "name": f"{FIRST_NAMES[uid % len(FIRST_NAMES)]} {uid}",
+                 "email": (f"host{uid}@bench.example.com" if uid <= hosts else f"guest{uid - hosts}@bench.example.com"),
+                 "password_hash": password_hash}
+                for uid in range(first + 1, min(first + batch_size, hosts + guests) + 1)
+            ])
+    log(f"  {hosts + guests} utilisateurs ({hosts} hôtes)")
+
+    owners = [host for host, size in enumerate(host_sizes, start=1) for _ in range(size)]
+    city_rank = Zipf(rng, len(CITIES), 1.0)
+    guest_rank = Zipf(rng, guests, 0.8)
+    window_start = anchor - timedelta(days=PAST_DAYS)
+    booking_id = message_id = 0
+    now = datetime.combine(anchor, datetime.min.time())
+
+    for first in range(1, listings + 1, batch_size):
+        rows = {"listings": [], "photos": [], "bookings": [], "reviews": [], "messages": []}
+        for listing_id in range(first, min(first + batch_size, listings + 1)):
+            host_id = owners[listing_id - 1]
+            city, country = CITIES[city_rank()]
+            kind, qualifier = rng.choice(KINDS), rng.choice(QUALIFIERS)
+            price = round(min(2000.0, rng.lognormvariate(4.4, 0.55)), 2)
+            rows["listings"].append({
+                "id": listing_id, "host_id": host_id, "title": f"{kind} {qualifier} à {city}",
+                "description": " ".join(rng.sample(SENTENCES, 3)), "city": city, "country": country,
+                "city_norm": staybnb.normalize_text(city), "country_norm": staybnb.normalize_text(country),
+                "price_per_night": price, "max_guests": rng.choice([1, 2, 2, 2, 3, 4, 4, 4, 5, 6, 8]),
+                "bedrooms": rng.randint(1, 4), "bathrooms": rng.randint(1, 2),
+                "amenities": ", ".join(rng.sample(AMENITIES, rng.randint(2, 6))),
+                "updated_at": now - timedelta(days=rng.randrange(PAST_DAYS)),
+            })
+            for i in range(rng.randint(1, 3)):
+                rows["photos"].append({"listing_id": listing_id, "filename": _photo_name(seed, listing_id, i),
+                                       "width": 1600, "height": 1067, "thumb_width": 480, "thumb_height": 320,
+                                       "medium_width": 1280, "medium_height": 853})
+
+            # Annonces très demandées et annonces délaissées : nombre de séjours en loi de Pareto
+            stays = min(60, round(rng.paretovariate(1.5) * bookings_per_listing / 3))
+            day = window_start
+            for _ in range(stays):
+                day += timedelta(days=rng.randint(0, max(1, (PAST_DAYS + FUTURE_DAYS) // max(stays, 1))))
+                nights = rng.choices(NIGHTS, NIGHT_WEIGHTS)[0]
+                end = day + timedelta(days=nights)
+                if end > anchor + timedelta(days=FUTURE_DAYS):
+                    break
+                booking_id += 1
+                guest_id = hosts + 1 + guest_rank()
+                status = rng.choices(STATUSES, STATUS_WEIGHTS)[0]
+                created = datetime.combine(day, datetime.min.time()) - timedelta(days=rng.randint(1, 60), hours=rng.randrange(24))
+                rows["bookings"].append({
+                    "id": booking_id, "user_id": guest_id, "listing_id": listing_id, "start_date": day,
+                    "end_date": end, "guests": 1 + rng.randrange(2), "total_price": round(nights * price, 2),
+                    "status": status, "created_at": created,
+                })
+                if status != "cancelled" and end < anchor and rng.random() < 0.35:
+                    rows["reviews"].append({
+                        "listing_id": listing_id, "user_id": guest_id,
+                        "rating": rng.choices(RATINGS, RATING_WEIGHTS)[0], "comment": rng.choice(COMMENTS),
+                        "created_at": datetime.combine(end, datetime.min.time()) + timedelta(days=rng.randint(1, 10)),
+                    })
+                if rng.random() < 0.25:
+                    for i in range(rng.randint(1, len(CHAT))):
+                        message_id += 1
+                        sender, receiver = (guest_id, host_id) if i % 2 == 0 else (host_id, guest_id)
+                        rows["messages"].append({
+                            "id": message_id, "listing_id": listing_id, "sender_id": sender,
+                            "receiver_id": receiver, "body": CHAT[i], "created_at": created + timedelta(hours=i),
+                        })
+                day = end
+
+        with engine.begin() as conn:
+            for table, model in (("listings", staybnb.Listing), ("photos", staybnb.Photo),
+                                 ("bookings", staybnb.Booking), ("reviews", staybnb.Review),
+                                 ("messages", staybnb.Message)):
+                if rows[table]:
+                    conn.execute(insert(model), rows[table])
+                if table != "listings":
+                    counts[table] += len(rows[table])
+        done = min(first + batch_size - 1, listings)
+        log(f"  {done}/{listings} annonces, {counts['bookings']} réservations ({time.perf_counter() - started:.0f}s)")
+
+    log("  données dérivées (calendrier, notes, conversations, FTS)...")
+    staybnb.init_schema()
+    counts["seconds"] = round(time.perf_counter() - started, 1)
+    return counts
+
+
+def ensure_database(listings, seed=1, data_dir=DEFAULT_DATA_DIR, bookings_per_listing=4, log=print):
+    """Chemin d'une base générée pour (listings, seed), créée si besoin ; renvoie (url, manifeste)."""
+    path = database_path(listings, seed, data_dir)
+    url = "sqlite:///" + path
+    manifest = load_manifest(path)
+    if manifest is not None and os.path.exists(path):
+        return url, manifest
+
+    import app as staybnb
+
+    os.makedirs(data_dir, exist_ok=True)
+    # Base sans manifeste : génération interrompue, on repart de zéro
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    log(f"Génération de {path}")
+    anchor = date.today()
+    flask_app = staybnb.create_app({"DATABASE_URL": url})
+    with flask_app.app_context():
+        counts = generate(staybnb, listings, seed, anchor, bookings_per_listing, log=log)
+        with staybnb.database.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    staybnb.database.dispose()
+    manifest = {"listings": listings, "seed": seed, "anchor": anchor.isoformat(),
+                "bookings_per_listing": bookings_per_listing, "password": PASSWORD, "counts": counts}
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return url, manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listings", type=int, nargs="+", default=[10000])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--bookings-per-listing", type=int, default=4, help="moyenne visée")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--force", action="store_true", help="régénère même si la base existe")
+    opts = parser.parse_args()
+
+    for listings in opts.listings:
+        path = database_path(listings, opts.seed, opts.data_dir)
+        if opts.force and os.path.exists(path + ".json"):
+            os.remove(path + ".json")
+        url, manifest = ensure_database(listings, opts.seed, opts.data_dir, opts.bookings_per_listing)
+        print(url)
+        print("  " + ", ".join(f"{k}={v}" for k, v in manifest["counts"].items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
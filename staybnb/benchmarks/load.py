@@ -0,0 +1,203 @@
+"""Test de charge HTTP : p50/p95/p99 et requêtes par seconde, par route.
+
+Des threads clients enchaînent pendant `--duration` secondes un mélange de
+pages (accueil, recherches, fiches annonces, dashboard, messages) tirées avec
+les mêmes déséquilibres que les données : les annonces et villes populaires
+reviennent plus souvent. Un client sur deux est connecté (compte hôte).
+
+Sans `--url`, l'application tourne dans ce processus (serveur werkzeug à
+threads) sur la base générée. Pour mesurer la configuration de production,
+lancer gunicorn sur la même base et passer son adresse :
+
+    python -m benchmarks.datagen --listings 100000
+    DATABASE_URL=sqlite:////tmp/staybnb-bench/bench-100000-s1.sqlite3 LOGIN_IP_BURST=0 gunicorn "app:create_app()"
+    python -m benchmarks.load --listings 100000 --url http://127.0.0.1:8000 --concurrency 32
+"""
+import argparse
+import http.cookiejar
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from bisect import bisect
+from datetime import date, timedelta
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import datagen, results
+
+CSRF = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+SEARCH_TERMS = ["piscine", "vue mer", "jardin", "terrasse", "calme", "plage"]
+# (route, poids, connecté seulement)
+ROUTES = [
+    ("home", 20, False),
+    ("search_city", 20, False),
+    ("search_dates", 10, False),
+    ("search_fts", 10, False),
+    ("listing", 30, False),
+    ("dashboard", 5, True),
+    ("inbox", 5, True),
+]
+
+
+class Traffic:
+    """Tirage des URL, partagé par les clients (chaque client a son propre générateur)."""
+
+    def __init__(self, manifest):
+        self.listings = manifest["listings"]
+        self.hosts = manifest["counts"]["hosts"]
+        self.anchor = date.fromisoformat(manifest["anchor"])
+        self.listing_cum = list(accumulate(1 / (k + 1) ** 0.8 for k in range(self.listings)))
+        self.city_cum = list(accumulate(1 / (k + 1) for k in range(len(datagen.CITIES))))
+
+    def _rank(self, rng, cum):
+        return bisect(cum, rng.random() * cum[-1])
+
+    def city(self, rng):
+        return urllib.parse.quote(datagen.CITIES[self._rank(rng, self.city_cum)][0])
+
+    def url(self, rng, route):
+        if route == "home":
+            return "/"
+        if route == "search_city":
+            return f"/?city={self.city(rng)}"
+        if route == "search_dates":
+            start = self.anchor + timedelta(days=rng.randrange(7, 150))
+            return f"/?city={self.city(rng)}&start={start}&end={start + timedelta(days=rng.randint(2, 7))}"
+        if route == "search_fts":
+            return f"/?q={urllib.parse.quote(rng.choice(SEARCH_TERMS))}"
+        if route == "listing":
+            return f"/listings/{self._rank(rng, self.listing_cum) + 1}"
+        if route == "dashboard":
+            return "/dashboard"
+        return "/messages"
+
+
+def _login(opener, base_url, email, password):
+    """True si la connexion a réussi : redirection hors de /login (en échec, le formulaire revient)."""
+    page = opener.open(base_url + "/login", timeout=30).read().decode()
+    token = CSRF.search(page)
+    data = {"email": email, "password": password}
+    if token:
+        data["csrf_token"] = token.group(1)
+    with opener.open(base_url + "/login", urllib.parse.urlencode(data).encode(), timeout=30) as response:
+        response.read()
+        return urllib.parse.urlsplit(response.geturl()).path != "/login"
+
+
+def client(worker_id, base_url, traffic, manifest, seed, warmup_until, stop_at, samples, lock):
+    rng = random.Random(seed * 1000 + worker_id)
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    durations, errors = {}, {}
+    logged_in = worker_id % 2 == 1
+    if logged_in:
+        email = f"host{rng.randint(1, traffic.hosts)}@bench.example.com"
+        try:
+            logged_in = _login(opener, base_url, email, manifest["password"])
+        except (urllib.error.URLError, OSError):
+            logged_in = False
+        if not logged_in:
+            # Erreur comptée même pendant la chauffe ; le client continue en anonyme,
+            # sinon ses pages connectées ne mesureraient que des redirections vers /login
+            errors["login"] = 1
+    routes = [r for r in ROUTES if logged_in or not r[2]]
+    names, weights = [r[0] for r in routes], [r[1] for r in routes]
+    while True:
+        route = rng.choices(names, weights)[0]
+        url = base_url + traffic.url(rng, route)
+        started = time.perf_counter()
+        if started >= stop_at:
+            break
+        failed = False
+        try:
+            with opener.open(url, timeout=60) as response:
+                response.read()
+        except (urllib.error.URLError, OSError):
+            failed = True
+        if started < warmup_until:
+            continue
+        if failed:
+            errors[route] = errors.get(route, 0) + 1
+        else:
+            durations.setdefault(route, []).append(time.perf_counter() - started)
+    with lock:
+        for route, values in durations.items():
+            samples["durations"].setdefault(route, []).extend(values)
+        for route, n in errors.items():
+            samples["errors"][route] = samples["errors"].get(route, 0) + n
+
+
+def run(base_url, traffic, manifest, concurrency, duration, warmup, seed):
+    samples = {"durations": {}, "errors": {}}
+    lock = threading.Lock()
+    begin = time.perf_counter()
+    warmup_until, stop_at = begin + warmup, begin + warmup + duration
+    threads = [threading.Thread(target=client, args=(i, base_url, traffic, manifest, seed, warmup_until,
+                                                     stop_at, samples, lock)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = {}
+    for route in ("login", *(r[0] for r in ROUTES)):
+        if route in samples["durations"] or route in samples["errors"]:
+            stats[route] = results.summarize(samples["durations"].get(route, []), duration,
+                                             samples["errors"].get(route, 0))
+    everything = [d for values in samples["durations"].values() for d in values]
+    stats["total"] = results.summarize(everything, duration, sum(samples["errors"].values()))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listings", type=int, nargs="+", default=[10000])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="serveur déjà lancé sur la base générée (défaut : serveur intégré)")
+    parser.add_argument("--concurrency", type=int, default=8, help="clients simultanés")
+    parser.add_argument("--duration", type=float, default=20, help="secondes mesurées")
+    parser.add_argument("--warmup", type=float, default=3, help="secondes de chauffe, non mesurées")
+    parser.add_argument("--data-dir", default=datagen.DEFAULT_DATA_DIR)
+    parser.add_argument("--output", help="fichier JSON (défaut : benchmarks/results/load-<date>.json)")
+    opts = parser.parse_args()
+
+    sizes = {}
+    for listings in opts.listings:
+        url, manifest = datagen.ensure_database(listings, opts.seed, opts.data_dir)
+        traffic = Traffic(manifest)
+        server = None
+        base_url = opts.url.rstrip("/") if opts.url else None
+        if base_url is None:
+            import logging
+
+            import app as staybnb
+            from werkzeug.serving import make_server
+
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)
+            # Limites de connexion levées : tous les clients viennent de 127.0.0.1
+            flask_app = staybnb.create_app({"DATABASE_URL": url, "LOGIN_IP_BURST": 0, "LOGIN_EMAIL_BURST": 0})
+            server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f"http://127.0.0.1:{server.server_port}"
+        print(f"{listings} annonces, {opts.concurrency} clients, {opts.duration:.0f}s sur {base_url}")
+        try:
+            sizes[str(listings)] = run(base_url, traffic, manifest, opts.concurrency, opts.duration,
+                                       opts.warmup, opts.seed)
+        finally:
+            if server is not None:
+                server.shutdown()
+                staybnb.database.dispose()
+        results.print_table(sizes[str(listings)])
+
+    params = {k: v for k, v in vars(opts).items() if k not in ("output", "data_dir")}
+    print("Résultats :", results.save("load", params, sizes, opts.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
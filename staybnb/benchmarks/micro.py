@@ -0,0 +1,166 @@
+"""Micro-benchmarks des requêtes critiques, sur bases générées (voir datagen.py).
+
+Mesure, hors HTTP et sans rendu de template, les fonctions appelées par les
+routes : listing_available() (index de disponibilités froid, puis chaud sur un
+jeu fixe d'annonces chargé avant la mesure),
+search_listings() pour les recherches de l'accueil, dashboard_data() pour
+un gros hôte, un hôte typique et un voyageur fréquent, et les rapports de
+/dashboard/analytics (12 mois, puis export CSV complet) du gros hôte. Une session neuve par
+appel, comme une requête HTTP.
+
+    python -m benchmarks.micro --listings 10000 100000 1000000
+    python -m benchmarks.compare benchmarks/results/micro-avant.json benchmarks/results/micro-apres.json
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import datagen, results
+
+
+WARM_LISTINGS = 1000  # annonces du cas chaud, sous AVAILABILITY_CACHE_SIZE
+
+
+def _cases(staybnb, manifest, rng):
+    """(nom, fonction(db)[, préparation()]) : chaque fonction tire ses paramètres dans `rng`."""
+    from sqlalchemy import func, select
+
+    n = manifest["listings"]
+    anchor = date.fromisoformat(manifest["anchor"])
+    db = staybnb.session_factory()
+    try:
+        by_host = (select(staybnb.Listing.host_id, func.count().label("n"))
+                   .group_by(staybnb.Listing.host_id).order_by(func.count().desc(), staybnb.Listing.host_id))
+        hosts = db.execute(by_host).all()
+        big_host, typical_host = hosts[0].host_id, hosts[len(hosts) // 2].host_id
+        frequent_guest = db.execute(select(staybnb.Booking.user_id).group_by(staybnb.Booking.user_id)
+                                    .order_by(func.count().desc()).limit(1)).scalar()
+    finally:
+        db.close()
+
+    def stay():
+        start = anchor + timedelta(days=rng.randrange(-30, 150))
+        return start, start + timedelta(days=rng.randint(2, 7))
+
+    # L'index ne sert que les séjours à venir : dates tirées à partir d'aujourd'hui,
+    # même si la base a été générée plus tôt
+    first_day = max(anchor, date.today())
+    warm_ids = rng.sample(range(1, n + 1), min(n, WARM_LISTINGS))
+
+    def future_stay():
+        start = first_day + timedelta(days=rng.randrange(0, 150))
+        return start, start + timedelta(days=rng.randint(2, 7))
+
+    def warm_availability():
+        staybnb.availability.invalidate()
+        staybnb.availability.free_ids(warm_ids, *future_stay())
+
+    def available(db):
+        return staybnb.listing_available(db, rng.choice(warm_ids), *future_stay())
+
+    def available_cold(db):
+        staybnb.availability.invalidate()
+        return staybnb.listing_available(db, rng.randint(1, n), *future_stay())
+
+    def search(**kwargs):
+        return lambda db: staybnb.search_listings(db, **kwargs)
+
+    def search_city_dates(db):
+        start, end = stay()
+        return staybnb.search_listings(db, city="paris", start=start, end=end)
+
+    def dashboard(user_id):
+        return lambda db: staybnb.dashboard_data(db, user_id)
+
+    def analytics(db):
+        end = staybnb.add_months(anchor.replace(day=1), 1)
+        start = staybnb.add_months(end, -12)
+        count = staybnb.host_listing_count(db, big_host)
+        return (staybnb.host_monthly_report(db, big_host, count, start, end),
+                staybnb.host_listing_report(db, big_host, start, end, 50))
+
+    def analytics_export(db):
+        return sum(1 for _ in staybnb.analytics_rows(db, big_host, "listing"))
+
+    return [
+        ("listing_available", available, warm_availability),
+        ("listing_available_cold", available_cold),
+        ("search_recent", search()),
+        ("search_deep_page", search(after=str(n // 2))),
+        ("search_city", search(city="paris")),
+        ("search_city_guests", search(city="lisbonne", guests=5)),
+        ("search_city_dates", search_city_dates),
+        ("search_fts", search(q="piscine")),
+        ("search_rating", search(sort="rating")),
+        ("dashboard_big_host", dashboard(big_host)),
+        ("dashboard_typical_host", dashboard(typical_host)),
+        ("dashboard_frequent_guest", dashboard(frequent_guest)),
+        ("analytics_big_host", analytics),
+        ("analytics_export_big_host", analytics_export),
+    ]
+
+
+def run_case(staybnb, fn, iterations, warmup, max_seconds, setup=None):
+    if setup:
+        setup()
+    for _ in range(warmup):
+        db = staybnb.session_factory()
+        try:
+            fn(db)
+        finally:
+            db.close()
+    durations = []
+    deadline = time.perf_counter() + max_seconds
+    while len(durations) < iterations and (len(durations) < 5 or time.perf_counter() < deadline):
+        db = staybnb.session_factory()
+        try:
+            started = time.perf_counter()
+            fn(db)
+            durations.append(time.perf_counter() - started)
+        finally:
+            db.close()
+    return results.summarize(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listings", type=int, nargs="+", default=[10000])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=200, help="appels mesurés par cas")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=10, help="durée maximale par cas")
+    parser.add_argument("--only", nargs="*", help="noms de cas à mesurer (défaut : tous)")
+    parser.add_argument("--data-dir", default=datagen.DEFAULT_DATA_DIR)
+    parser.add_argument("--output", help="fichier JSON (défaut : benchmarks/results/micro-<date>.json)")
+    opts = parser.parse_args()
+
+    import app as staybnb
+
+    sizes = {}
+    for listings in opts.listings:
+        url, manifest = datagen.ensure_database(listings, opts.seed, opts.data_dir)
+        flask_app = staybnb.create_app({"DATABASE_URL": url})
+        rng = random.Random(opts.seed)
+        print(f"{listings} annonces ({url})")
+        with flask_app.app_context():
+            sizes[str(listings)] = {}
+            for name, fn, *setup in _cases(staybnb, manifest, rng):
+                if opts.only and name not in opts.only:
+                    continue
+                sizes[str(listings)][name] = run_case(staybnb, fn, opts.iterations, opts.warmup, opts.max_seconds,
+                                                      *setup)
+            results.print_table(sizes[str(listings)])
+        staybnb.database.dispose()
+
+    params = {k: v for k, v in vars(opts).items() if k not in ("output", "data_dir")}
+    print("Résultats :", results.save("micro", params, sizes, opts.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""Budget de requêtes SQL par route.
+
+Remplit une base temporaire (un hôte avec beaucoup de réservations reçues,
+une annonce avec beaucoup d'avis et de photos), appelle chaque route avec le
+client de test Flask et compte les requêtes SQL émises. Code de sortie 1 si
+une route dépasse son budget : un chargement paresseux (N+1) réintroduit
+dans un template fait exploser le compteur.
+
+    python -m benchmarks.query_budget
+"""
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Nombre maximal de requêtes SQL par requête HTTP (chargement de current_user compris)
+BUDGETS = {
+    "/": 3,
+    "/?city=paris&start={start}&end={end}": 3,
+    "/listings/{listing_id}": 4,
+    "/dashboard": 5,
+    "/dashboard/analytics": 4,
+    "/dashboard/analytics.csv?by=listing": 3,
+    "/messages": 3,
+    "/messages/{guest_id}": 5,
+    "/messages/{guest_id}?before=999999": 4,
+}
+
+
+def populate(staybnb, bookings=500, reviews=200):
+    from werkzeug.security import generate_password_hash
+
+    db = staybnb.session_factory()
+    try:
+        host = staybnb.User(name="Hôte", email="host@bench.example.com", password_hash=generate_password_hash("bench1234"))
+        guests = [staybnb.User(name=f"Voyageur {i}", email=f"guest{i}@bench.example.com", password_hash="x") for i in range(50)]
+        db.add(host)
+        db.add_all(guests)
+        db.flush()
+        listings = [staybnb.Listing(host_id=host.id, title=f"Annonce {i}", description="Description de test",
+                                    city="Paris", country="France", price_per_night=80.0 + i, max_guests=4,
+                                    bedrooms=2, bathrooms=1, amenities="Wi-Fi") for i in range(30)]
+        db.add_all(listings)
+        db.flush()
+        for l in listings:
+            db.add_all(staybnb.Photo(listing_id=l.id, filename=f"bench_{l.id}_{i}.jpg") for i in range(3))
+        first = date.today() - timedelta(days=bookings)
+        for i in range(bookings):
+            start = first + timedelta(days=i)
+            db.add(staybnb.Booking(user_id=guests[i % len(guests)].id, listing_id=listings[i % len(listings)].id,
+                                   start_date=start, end_date=start + timedelta(days=1), guests=1,
+                                   total_price=100.0, status="confirmed"))
+        db.add_all(staybnb.Review(listing_id=listings[0].id, user_id=guests[i % len(guests)].id,
+                                  rating=1 + i % 5, comment="Séjour parfait") for i in range(reviews))
+        db.add_all(staybnb.Message(sender_id=guests[0].id, receiver_id=host.id, body=f"Message {i}") for i in range(20))
+        db.commit()
+        return {"listing_id": listings[0].id, "guest_id": guests[0].id,
+                "start": date.today().isoformat(), "end": (date.today() + timedelta(days=3)).isoformat()}
+    finally:
+        db.close()
+
+
+def main():
+    tmpdir = tempfile.mkdtemp(prefix="staybnb-queries-")
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tmpdir, "queries.sqlite3")
+    import app as staybnb
+    from sqlalchemy import event
+
+    # Cache des utilisateurs coupé : on mesure le pire cas, utilisateur relu en base
+    flask_app = staybnb.create_app({"WTF_CSRF_ENABLED": False, "USER_CACHE_TTL": 0})
+    # Contexte refermé avant les requêtes : sinon `g` (et l'utilisateur chargé) survivrait d'une requête à l'autre
+    with flask_app.app_context():
+        staybnb.init_schema()
+        ids = populate(staybnb)
+    client = flask_app.test_client()
+    client.post("/login", data={"email": "host@bench.example.com", "password": "bench1234"})
+
+    statements = []
+    for eng in {staybnb.database.engine, staybnb.database.read_engine}:
+        event.listen(eng, "before_cursor_execute", lambda conn, cursor, stmt, *args: statements.append(stmt))
+
+    failures = 0
+    for pattern, budget in BUDGETS.items():
+        url = pattern.format(**ids)
+        statements.clear()
+        response = client.get(url)
+        # BEGIN émis par _sqlite_begin ne compte pas comme une requête
+        count = sum(1 for stmt in statements if not stmt.startswith("BEGIN"))
+        ok = response.status_code == 200 and count <= budget
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {url:<45} {response.status_code} {count:>3} requêtes (budget {budget})")
+        if not ok:
+            for stmt in statements:
+                print("       ", " ".join(stmt.split())[:150])
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
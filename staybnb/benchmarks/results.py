@@ -0,0 +1,82 @@
+"""Résultats des benchmarks : percentiles, fichiers JSON horodatés.
+
+Chaque fichier contient le contexte de la mesure (commit git, Python, SQLite,
+paramètres) et, par taille de base, une entrée par cas mesuré avec p50, p95,
+p99 (ms) et le débit. `python -m benchmarks.compare` confronte deux fichiers.
+"""
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(ordered, p):
+    # Rang le plus proche sur des durées déjà triées
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def summarize(durations, elapsed=None, errors=0):
+    """Durées en secondes -> statistiques en millisecondes ; `elapsed` donne le débit réel."""
+    ordered = sorted(durations)
+    n = len(ordered)
+    total = elapsed if elapsed is not None else sum(ordered)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "count": n,
+        "errors": errors,
+        "mean_ms": ms(sum(ordered) / n if n else None),
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1] if n else None),
+        "per_second": round(n / total, 1) if total else None,
+    }
+
+
+def cell(value):
+    # Valeur absente (aucune mesure, ou métrique inconnue d'un ancien fichier)
+    return "n/a" if value is None else value
+
+
+def print_table(results):
+    print(f"  {'cas':<32} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'/s':>9}")
+    for name, r in results.items():
+        print(f"  {name:<32} {r['count']:>6} {cell(r['p50_ms']):>9} {cell(r['p95_ms']):>9} {cell(r['p99_ms']):>9} "
+              f"{cell(r['per_second']):>9}"
+              + (f"  ({r['errors']} erreurs)" if r.get("errors") else ""))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(kind, params, sizes, output=None):
+    """Écrit {contexte, params, sizes: {taille: {cas: stats}}} ; renvoie le chemin du fichier."""
+    now = datetime.now()
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{kind}-{now:%Y%m%d-%H%M%S}.json")
+    payload = {
+        "kind": kind,
+        "created_at": now.isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "sqlite": sqlite3.sqlite_version,
+        "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} CPU)",
+        "params": params,
+        "sizes": sizes,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    return output
@@ -0,0 +1,85 @@
+"""Temps de démarrage : import du module et create_app().
+
+Lance `python -X importtime -c "import app"` dans un sous-processus (interpréteur
+neuf, comme un worker qui démarre), relève le temps cumulé de chaque import et
+affiche les plus lourds : ce sont les candidats à un import différé dans la
+fonction qui s'en sert. Mesure ensuite create_app(), qui ne doit ouvrir aucune
+connexion ni créer de fichier. Code de sortie 1 au-delà du budget.
+
+Le budget porte sur la médiane des démarrages. L'import d'app coûte environ
+800 ms sur une machine modeste (surtout sqlalchemy.orm et flask), à ±10 % d'une
+série à l'autre : le budget par défaut garde 50 % de marge et ne signale que les
+vraies régressions, comme un import lourd remis au niveau du module.
+
+    python -m benchmarks.startup --runs 9 --import-budget-ms 1200 --create-budget-ms 100
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(env):
+    """Temps cumulé (µs) par module importé, d'après -X importtime."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                          cwd=APP_DIR, env=env, capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Le niveau d'indentation donne la profondeur : on garde les imports directs d'app
+        depth = (len(name) - len(name.lstrip())) // 2
+        times[name.strip()] = (int(cumulative), depth)
+    return times
+
+
+def create_app_time(env):
+    code = (
+        "import time, app\n"
+        "t = time.perf_counter(); app.create_app(); t = time.perf_counter() - t\n"
+        "assert app.database._engine is None, 'create_app() a créé un moteur'\n"
+        "print(t * 1e6)\n"
+    )
+    proc = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, env=env,
+                          capture_output=True, text=True, check=True)
+    return float(proc.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=9, help="médiane sur N démarrages")
+    parser.add_argument("--import-budget-ms", type=float, default=1200)
+    parser.add_argument("--create-budget-ms", type=float, default=100)
+    parser.add_argument("--top", type=int, default=10, help="imports directs les plus lourds à afficher")
+    opts = parser.parse_args()
+
+    # Base inexistante dans un dossier vide : l'import ne doit pas la créer
+    tmpdir = tempfile.mkdtemp(prefix="staybnb-startup-")
+    db_path = os.path.join(tmpdir, "startup.sqlite3")
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + db_path)
+
+    runs = [import_times(env) for _ in range(opts.runs)]
+    app_import = statistics.median(r["app"][0] for r in runs) / 1000
+    direct = {name: statistics.median(r[name][0] for r in runs if name in r) / 1000
+              for name, (_, depth) in runs[0].items() if depth == 1}
+    create = statistics.median(create_app_time(env) for _ in range(opts.runs)) / 1000
+    side_effects = os.listdir(tmpdir)
+
+    print(f"import app      {app_import:8.1f} ms (médiane de {opts.runs}, budget {opts.import_budget_ms:.0f})")
+    for name, ms in sorted(direct.items(), key=lambda kv: -kv[1])[:opts.top]:
+        print(f"  {name:<28} {ms:8.1f} ms")
+    print(f"create_app()    {create:8.1f} ms (budget {opts.create_budget_ms:.0f})")
+    if side_effects:
+        print(f"FAIL fichiers créés au démarrage : {', '.join(side_effects)}")
+
+    failed = app_import > opts.import_budget_ms or create > opts.create_budget_ms or side_effects
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+"""Pools de threads système pour le travail lourd hors requête (hachage, images).
+
+Sous gunicorn `-k gevent`, `threading` est remplacé par des greenlets : un
+ThreadPoolExecutor ordinaire tournerait alors dans le thread du hub et un
+calcul long (scrypt, rendu Pillow) bloquerait tout le worker, connexions SSE
+comprises. On prend dans ce cas le threadpool natif de gevent, dont les
+futures s'attendent sans bloquer les autres greenlets.
+
+Les fonctions exécutées dans ces pools ne doivent pas toucher aux primitives
+patchées par gevent (verrous, session SQLAlchemy...) : calcul pur uniquement.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+
+def native_executor(workers, name):
+    try:
+        from gevent import monkey
+    except ImportError:
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+    if monkey.is_module_patched("threading"):
+        from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+
+        return NativeThreadPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
@@ -0,0 +1,28 @@
+"""Configuration gunicorn, lue automatiquement depuis ce dossier :
+
+    gunicorn "app:create_app()"
+
+Les connexions /events (SSE) restent ouvertes en permanence. Avec des workers
+gevent, chacune ne coûte qu'une greenlet au lieu d'un thread : un worker tient
+des milliers de clients inactifs.
+
+Notifications et invalidations de cache ne passent d'un worker à l'autre que
+par EVENTS_BROKER_URL (Redis) : sans relais, un seul worker par défaut, et le
+démarrage échoue si WEB_CONCURRENCY en demande plusieurs.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+relayed = bool(os.environ.get("EVENTS_BROKER_URL"))
+workers = int(os.environ.get("WEB_CONCURRENCY", 2 if relayed else 1))
+if workers > 1 and not relayed:
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={workers} sans EVENTS_BROKER_URL : les notifications SSE et les "
+        "invalidations de cache d'un worker n'atteindraient pas les autres. Définir "
+        "EVENTS_BROKER_URL=redis://... ou WEB_CONCURRENCY=1."
+    )
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+# Connexions simultanées par worker gevent (SSE comprises)
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 2000))
+timeout = 30
+keepalive = 5
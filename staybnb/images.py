@@ -0,0 +1,121 @@
+"""Photos : stockage adressé par le contenu et déclinaisons redimensionnées.
+
+Un fichier reçu est nommé d'après le SHA-256 de son contenu : deux envois
+identiques ne sont stockés qu'une fois et deux fichiers différents ne peuvent
+plus s'écraser. Chaque photo est déclinée en vignette (cartes de l'accueil) et
+en taille moyenne (fiche annonce), en WebP et en JPEG ; les templates les
+proposent via `srcset` et le navigateur télécharge la plus petite qui suffit.
+
+Le redimensionnement tourne dans un pool de threads système en arrière-plan
+(Pillow libère le GIL pendant le décodage, le redimensionnement et l'encodage)
+pour ne pas bloquer la requête d'envoi, ni, sous gevent, le worker entier
+(voir executors.py). Pillow n'est importé qu'au premier traitement.
+"""
+import hashlib
+import io
+import os
+import threading
+
+from executors import native_executor
+
+# Largeur maximale de chaque déclinaison, en pixels (jamais agrandie)
+VARIANTS = {"thumb": 480, "medium": 1280}
+# WebP d'abord (plus léger), JPEG pour les navigateurs qui ne le lisent pas
+FORMATS = {"webp": {"quality": 80, "method": 4}, "jpg": {"quality": 82, "optimize": True, "progressive": True}}
+EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 8 * 1024 * 1024
+ORIENTATION = 0x0112  # tag EXIF : photo prise en portrait, pixels stockés couchés
+
+
+def content_name(digest, ext):
+    ext = ".jpg" if ext == ".jpeg" else ext
+    return f"{digest[:32]}{ext}"
+
+
+def variant_name(filename, variant, fmt):
+    return f"{os.path.splitext(filename)[0]}_{variant}.{fmt}"
+
+
+def store(stream, storage, ext):
+    """Range `stream` dans `storage` sous un nom dérivé de son contenu ; renvoie (nom, sha256).
+
+    Le contenu est haché pendant sa copie dans un tampon (en mémoire jusqu'à
+    SPOOL_SIZE, sur disque au-delà) ; s'il existe déjà il n'est pas réécrit.
+    """
+    import tempfile
+
+    digest = hashlib.sha256()
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as buf:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            buf.write(chunk)
+        filename = content_name(digest.hexdigest(), ext)
+        if not storage.exists(filename):
+            buf.seek(0)
+            storage.save(filename, buf)
+    return filename, digest.hexdigest()
+
+
+def store_file(path, storage, ext):
+    """Comme store(), pour un fichier déjà sur disque (supprimé ensuite)."""
+    with open(path, "rb") as f:
+        result = store(f, storage, ext)
+    os.remove(path)
+    return result
+
+
+def _flatten(img):
+    # JPEG n'a pas de transparence : on pose les images RGBA/palette sur du blanc
+    from PIL import Image
+
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB") if img.mode != "RGB" else img
+
+
+def render_variants(storage, filename):
+    """Écrit les déclinaisons manquantes de `filename` ; renvoie les dimensions pour Photo."""
+    from PIL import Image, ImageOps
+
+    with storage.open(filename) as f, Image.open(f) as img:
+        width, height = img.size
+        if img.getexif().get(ORIENTATION, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        # Décodage JPEG à échelle réduite quand la plus grande déclinaison le permet
+        img.draft("RGB", (max(VARIANTS.values()), max(VARIANTS.values())))
+        img = _flatten(ImageOps.exif_transpose(img))
+    dims = {"width": width, "height": height}
+    for variant, max_width in VARIANTS.items():
+        scaled = img
+        if img.width > max_width:
+            scaled = img.resize((max_width, max(1, round(img.height * max_width / img.width))), Image.LANCZOS)
+        for fmt, options in FORMATS.items():
+            name = variant_name(filename, variant, fmt)
+            if not storage.exists(name):
+                buf = io.BytesIO()
+                scaled.save(buf, format="JPEG" if fmt == "jpg" else "WEBP", **options)
+                buf.seek(0)
+                storage.save(name, buf)
+        dims[f"{variant}_width"], dims[f"{variant}_height"] = scaled.size
+    return dims
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def submit(fn, *args, workers=2):
+    """Exécute fn(*args) dans le pool d'arrière-plan (créé au premier appel) ; renvoie le Future.
+
+    Calcul pur seulement (render_variants) : l'écriture en base se fait hors du pool.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = native_executor(workers, "images")
+    return _pool.submit(fn, *args)
@@ -0,0 +1,201 @@
+"""Import en masse d'annonces (CSV / JSONL + photos) et données de démo.
+
+Utilisé par les commandes `flask seed` et `flask import-listings` (voir app.py).
+Le fichier est lu en flux et inséré par lots dans de grosses transactions ;
+les photos sont téléchargées ou copiées en parallèle, hors transaction, par un
+pool de threads, qui les range sous leur empreinte SHA-256 et en génère les
+vignettes (voir images.py). La mémoire reste bornée par la taille d'un lot.
+"""
+import csv
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from flask import current_app
+from sqlalchemy import insert, select
+
+import images
+from app import PHOTO_DIMENSIONS, database, hash_password, normalize_text, Listing, Photo, User
+
+# Copie hors ligne des annonces de démo (photos locales), utilisée sans réseau
+DEMO_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "demo")
+
+DEMO_HOST = {"name": "Hôte Démo", "email": "demo@staybnb.local", "password": "demo1234"}
+
+DEMO_LISTINGS = [
+    {"title":"Loft lumineux près du Canal Saint-Martin","description":"Grand loft refait à neuf, hauteur sous plafond, cuisine ouverte, idéal pour un city-break.","city":"Paris","country":"France","price":145,"max_guests":3,"bedrooms":1,"bathrooms":1,"amenities":"Wi-Fi, Cuisine équipée, Lave-linge, Chauffage, TV","photos":["https://picsum.photos/id/1067/1200/800","https://picsum.photos/id/1018/1200/800"]},
+    {"title":"Appartement cosy près du Vieux-Port","description":"Ambiance méditerranéenne, balcon ensoleillé, parfait pour explorer Marseille.","city":"Marseille","country":"France","price":95,"max_guests":2,"bedrooms":1,"bathrooms":1,"amenities":"Wi-Fi, Climatisation, Cuisine, Machine à café","photos":["https://picsum.photos/id/1025/1200/800","https://picsum.photos/id/103/1200/800"]},
+    {"title":"Duplex design sur les quais","description":"Style contemporain, vue sur la Saône, idéal pour les amoureux d’architecture.","city":"Lyon","country":"France","price":120,"max_guests":4,"bedrooms":2,"bathrooms":1,"amenities":"Wi-Fi, Lave-vaisselle, Chauffage, TV, Lit bébé","photos":["https://picsum.photos/id/1043/1200/800","https://picsum.photos/id/1050/1200/800"]},
+    {"title":"Studio vue mer Promenade des Anglais","description":"Face à la mer, terrasse privée et accès plage à 2 minutes.","city":"Nice","country":"France","price":130,"max_guests":2,"bedrooms":1,"bathrooms":1,"amenities":"Wi-Fi, Climatisation, Terrasse, Ascenseur","photos":["https://picsum.photos/id/1011/1200/800","https://picsum.photos/id/1016/1200/800"]},
+    {"title":"Maison en pierre proche des vignobles","description":"Charme de l’ancien, grande cuisine, jardin au calme à 20 min de Bordeaux.","city":"Bordeaux","country":"France","price":160,"max_guests":5,"bedrooms":3,"bathrooms":2,"amenities":"Wi-Fi, Cheminée, Jardin, Parking, Barbecue","photos":["https://picsum.photos/id/1040/1200/800","https://picsum.photos/id/1008/1200/800"]},
+]
+
+
+# =========================================================
+# Lecture en flux
+# =========================================================
+def read_records(path, fmt=None):
+    """Itère sur les annonces d'un fichier .csv ou .jsonl, une ligne à la fois."""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            # Colonne "photos" : chemins ou URLs séparés par "|"
+            for row in csv.DictReader(f):
+                row["photos"] = [p for p in (row.get("photos") or "").split("|") if p.strip()]
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def batched(iterable, size):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+def _listing_row(record, host_id):
+    city, country = record["city"].strip(), record["country"].strip()
+    return {
+        "host_id": host_id,
+        "title": record["title"].strip(),
+        "description": record["description"],
+        "city": city,
+        "country": country,
+        "city_norm": normalize_text(city),
+        "country_norm": normalize_text(country),
+        "price_per_night": float(record.get("price_per_night") or record["price"]),
+        "max_guests": int(record["max_guests"]),
+        "bedrooms": int(record["bedrooms"]),
+        "bathrooms": int(record["bathrooms"]),
+        "amenities": record.get("amenities") or "",
+    }
+
+# =========================================================
+# Photos
+# =========================================================
+def fetch_photo(source, dest, base_dir=None):
+    """Télécharge (http/https) ou copie (chemin local) une photo ; renvoie True si réussi."""
+    try:
+        if source.startswith(("http://", "https://")):
+            with urllib.request.urlopen(source, timeout=15) as resp, open(dest, "wb") as out:
+                shutil.copyfileobj(resp, out)
+        else:
+            shutil.copyfile(os.path.join(base_dir or "", source), dest)
+        return True
+    except Exception as e:
+        print("Photo ignorée:", source, "-", e)
+        return False
+
+def _photo_jobs(listing_ids, records):
+    for listing_id, record in zip(listing_ids, records):
+        for source in record.get("photos") or []:
+            ext = os.path.splitext(source.split("?")[0])[1].lower()
+            yield listing_id, source, ext if ext in images.EXTENSIONS else ".jpg"
+
+def import_photo(job, store, base_dir=None):
+    """Récupère, range sous son empreinte et décline une photo ; renvoie la ligne Photo ou None."""
+    listing_id, source, ext = job
+    fd, tmp = tempfile.mkstemp(prefix="staybnb-import-", suffix=ext)
+    os.close(fd)
+    if not fetch_photo(source, tmp, base_dir):
+        os.remove(tmp)
+        return None
+    filename, digest = images.store_file(tmp, store, ext)
+    try:
+        dims = images.render_variants(store, filename)
+    except Exception as e:
+        # Fichier gardé tel quel ; `flask process-photos` réessaiera
+        print("Déclinaisons impossibles:", source, "-", e)
+        dims = dict.fromkeys(PHOTO_DIMENSIONS)
+    return {"listing_id": listing_id, "filename": filename, "content_hash": digest, **dims}
+
+# =========================================================
+# Import
+# =========================================================
+def _host_resolver(conn, default_email):
+    cache = {}
+
+    def resolve(email):
+        email = (email or default_email).strip().lower()
+        if email not in cache:
+            host_id = conn.execute(select(User.id).where(User.email == email)).scalar()
+            if host_id is None:
+                # Hôte créé sans mot de passe utilisable : connexion après réinitialisation
+                host_id = conn.execute(insert(User).values(
+                    name=email.split("@")[0], email=email, password_hash=hash_password(os.urandom(16).hex())
+                ).returning(User.id)).scalar()
+            cache[email] = host_id
+        return cache[email]
+
+    return resolve
+
+def import_records(records, host_email, batch_size=2000, workers=8, photos_dir=None, skip_photos=False, log=print):
+    """Insère les annonces par lots ; renvoie (annonces, photos, secondes)."""
+    store = current_app.extensions["storage"]
+    started = time.perf_counter()
+    n_listings = n_photos = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in batched(records, batch_size):
+            with database.engine.begin() as conn:
+                resolve_host = _host_resolver(conn, host_email)
+                rows = [_listing_row(r, resolve_host(r.get("host_email"))) for r in batch]
+                result = conn.execute(insert(Listing).returning(Listing.id, sort_by_parameter_order=True), rows)
+                listing_ids = [row.id for row in result]
+            n_listings += len(listing_ids)
+
+            if not skip_photos:
+                jobs = list(_photo_jobs(listing_ids, batch))
+                photo_rows = [row for row in pool.map(lambda job: import_photo(job, store, photos_dir), jobs) if row]
+                if photo_rows:
+                    with database.engine.begin() as conn:
+                        conn.execute(insert(Photo), photo_rows)
+                n_photos += len(photo_rows)
+
+            elapsed = time.perf_counter() - started
+            log(f"  {n_listings} annonces, {n_photos} photos — {n_listings / elapsed:.0f} annonces/s")
+
+    return n_listings, n_photos, time.perf_counter() - started
+
+def network_available(url, timeout=3):
+    """Le serveur de `url` accepte-t-il une connexion ? (sans télécharger quoi que ce soit)"""
+    parts = urllib.parse.urlsplit(url)
+    try:
+        socket.create_connection((parts.hostname, parts.port or 443), timeout=timeout).close()
+        return True
+    except OSError:
+        return False
+
+def seed_demo(fixtures_dir=None, skip_photos=False, workers=8):
+    """Annonces de démo si la base est vide, depuis `fixtures_dir` (listings.jsonl + photos) si donné.
+
+    Sans `fixtures_dir`, les photos sont téléchargées ; si leur serveur est
+    injoignable, on prend les fixtures livrées avec le projet (DEMO_FIXTURES_DIR).
+    """
+    with database.engine.connect() as conn:
+        if conn.execute(select(Listing.id).limit(1)).first():
+            print("Base déjà initialisée, rien à faire.")
+            return
+    with database.engine.begin() as conn:
+        if conn.execute(select(User.id).where(User.email == DEMO_HOST["email"])).first() is None:
+            conn.execute(insert(User).values(name=DEMO_HOST["name"], email=DEMO_HOST["email"],
+                                             password_hash=hash_password(DEMO_HOST["password"])))
+    if not fixtures_dir and not skip_photos and not network_available(DEMO_LISTINGS[0]["photos"][0]):
+        print("Réseau indisponible : annonces et photos locales de", DEMO_FIXTURES_DIR)
+        fixtures_dir = DEMO_FIXTURES_DIR
+    if fixtures_dir:
+        records = read_records(os.path.join(fixtures_dir, "listings.jsonl"))
+    else:
+        records = DEMO_LISTINGS
+    import_records(records, DEMO_HOST["email"], workers=workers, photos_dir=fixtures_dir, skip_photos=skip_photos)
+    print("✅ Base de démo initialisée.")
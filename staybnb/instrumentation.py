@@ -0,0 +1,289 @@
+"""Mesures de performance : durée des requêtes, requêtes SQL, profilage.
+
+Pour chaque requête HTTP on relève la durée, le nombre de requêtes SQL et leur
+durée cumulée, et le nombre d'objets chargés par l'ORM. Tout est agrégé en
+histogrammes par route, exposés au format Prometheus sur /metrics (valeurs du
+processus : un worker gunicorn = une série) et résumés dans l'en-tête
+`Server-Timing` (visible dans l'onglet Réseau du navigateur).
+
+Requêtes SQL lentes (`SLOW_QUERY_MS`) : journalisées (logger "staybnb.sql")
+sous forme normalisée, littéraux remplacés par `?`, pour que les occurrences
+d'une même requête se regroupent.
+
+Profilage (`PROFILE_SLOW_MS` > 0) : un thread relève la pile de chaque requête
+en cours toutes les `PROFILE_INTERVAL_MS` ms ; une requête plus lente que le
+seuil laisse dans `PROFILE_DIR` un fichier de piles « repliées », lisible par
+flamegraph.pl ou https://www.speedscope.app. Réservé aux workers à threads
+(serveur de développement, gunicorn sync/gthread) : sous gevent, toutes les
+greenlets partagent un thread et le profilage est désactivé.
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Mapper
+
+logger = logging.getLogger("staybnb.sql")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+OBJECT_BUCKETS = (0, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM = re.compile(r"%\(\w+\)s|%s|:\w+|\$\d+")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def normalize_sql(statement):
+    """Forme canonique d'une requête : littéraux et paramètres -> ?, listes IN repliées."""
+    sql = " ".join(statement.split())
+    sql = _STRING.sub("?", sql)
+    sql = _PARAM.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    return _IN_LIST.sub("(?, ...)", sql)
+
+
+def _label_pairs(names, values):
+    return ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+
+
+class Counters:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{{{_label_pairs(self.labels, values)}}} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, (counts, total, count) in sorted(self._series.items()):
+                labels = _label_pairs(self.labels, values)
+                sep = "," if labels else ""
+                for bound, n in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {n}')
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{labels}}} {total:.6f}")
+                lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_qualname}".replace(" ", "_").replace(";", ":"))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Relève périodiquement la pile des threads inscrits (un compteur de piles par thread)."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, ident):
+        with self._lock:
+            self._active[ident] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self, ident):
+        with self._lock:
+            return self._active.pop(ident, Counter())
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None and ident != me:
+                        stacks[_collapse(frame)] += 1
+
+
+def write_folded(path, stacks):
+    """Une ligne `pile;repliée nombre` par pile : format de flamegraph.pl et speedscope."""
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+class RequestStats:
+    __slots__ = ("endpoint", "start", "queries", "sql_seconds", "objects")
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint or "none"
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.objects = 0
+
+
+def _current_stats():
+    return g.get("perf_stats") if has_app_context() else None
+
+
+class Instrumentation:
+    def __init__(self):
+        self.slow_query_seconds = 0.1
+        self.profile_seconds = 0
+        self.profile_dir = None
+        self.profiler = None
+        self.request_seconds = Histogram(
+            "staybnb_http_request_duration_seconds", "Durée de traitement des requêtes HTTP",
+            LATENCY_BUCKETS, ("endpoint", "method"))
+        self.responses = Counters(
+            "staybnb_http_requests_total", "Requêtes HTTP traitées", ("endpoint", "method", "status"))
+        self.request_queries = Histogram(
+            "staybnb_sql_queries_per_request", "Requêtes SQL émises par requête HTTP",
+            COUNT_BUCKETS, ("endpoint",))
+        self.request_objects = Histogram(
+            "staybnb_orm_objects_per_request", "Objets chargés par l'ORM par requête HTTP",
+            OBJECT_BUCKETS, ("endpoint",))
+        self.query_seconds = Histogram(
+            "staybnb_sql_query_duration_seconds", "Durée des requêtes SQL", QUERY_BUCKETS, ("endpoint",))
+        self.slow_queries = Counters(
+            "staybnb_sql_slow_queries_total", "Requêtes SQL au-delà de SLOW_QUERY_MS", ("endpoint",))
+        self._hooked = False
+
+    def init_app(self, app):
+        self.slow_query_seconds = app.config["SLOW_QUERY_MS"] / 1000
+        self.profile_seconds = app.config["PROFILE_SLOW_MS"] / 1000
+        self.profile_dir = app.config["PROFILE_DIR"]
+        self.profiler = None
+        if self.profile_seconds:
+            if _gevent_patched():
+                app.logger.warning("PROFILE_SLOW_MS ignoré : profilage impossible avec des workers gevent")
+            else:
+                self.profiler = SamplingProfiler(app.config["PROFILE_INTERVAL_MS"] / 1000)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if not self._hooked:
+            # Au niveau des classes : couvre les moteurs créés plus tard (primaire, réplique)
+            event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+            event.listen(Engine, "handle_error", self._query_failed)
+            event.listen(Mapper, "load", self._object_loaded)
+            self._hooked = True
+
+    def _before_request(self):
+        g.perf_stats = RequestStats(request.endpoint)
+        if self.profiler:
+            self.profiler.start(threading.get_ident())
+
+    def _after_request(self, response):
+        stats = g.pop("perf_stats", None)
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats.start
+        endpoint = stats.endpoint
+        self.request_seconds.observe(elapsed, endpoint, request.method)
+        self.responses.inc(endpoint, request.method, response.status_code)
+        self.request_queries.observe(stats.queries, endpoint)
+        self.request_objects.observe(stats.objects, endpoint)
+        response.headers["Server-Timing"] = (
+            f'app;dur={elapsed * 1000:.1f}, db;dur={stats.sql_seconds * 1000:.1f};desc="{stats.queries} SQL"')
+        if self.profiler:
+            stacks = self.profiler.stop(threading.get_ident())
+            if elapsed >= self.profile_seconds and stacks:
+                self._dump_profile(endpoint, elapsed, stacks)
+        return response
+
+    def _dump_profile(self, endpoint, elapsed, stacks):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint.replace('.', '_')}-{elapsed * 1000:.0f}ms.folded"
+        path = os.path.join(self.profile_dir, name)
+        write_folded(path, stacks)
+        logger.warning("requête lente %s %s (%.0f ms) : profil dans %s", request.method, request.path, elapsed * 1000, path)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = _current_stats()
+        endpoint = "none"
+        if stats is not None:
+            stats.queries += 1
+            stats.sql_seconds += elapsed
+            endpoint = stats.endpoint
+        self.query_seconds.observe(elapsed, endpoint)
+        if elapsed >= self.slow_query_seconds:
+            self.slow_queries.inc(endpoint)
+            logger.warning("requête SQL lente (%.1f ms, %s) : %s", elapsed * 1000, endpoint, normalize_sql(statement))
+
+    def _query_failed(self, exception_context):
+        # Pas d'after_cursor_execute après une erreur : on retire le départ empilé
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+    def _object_loaded(self, target, context):
+        stats = _current_stats()
+        if stats is not None:
+            stats.objects += 1
+
+    def render(self):
+        lines = []
+        for metric in (self.request_seconds, self.responses, self.request_queries,
+                       self.request_objects, self.query_seconds, self.slow_queries):
+            lines.extend(metric.render())
+        return lines
+
+
+def _gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
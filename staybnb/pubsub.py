@@ -0,0 +1,176 @@
+"""Diffusion d'événements aux navigateurs connectés (route /events, SSE).
+
+Chaque connexion SSE s'abonne aux événements de son utilisateur ; les commits
+de messages et de réservations publient (voir app.py). Par défaut tout reste
+dans le processus. Avec plusieurs workers, `EVENTS_BROKER_URL=redis://...`
+fait passer chaque événement par Redis pour qu'il atteigne le worker qui tient
+la connexion du destinataire (redis-py n'est importé que dans ce cas).
+
+Le même canal transporte les diffusions à tous les workers (`broadcast`), par
+exemple les invalidations de cache : sans elles, un worker servirait des pages
+périmées jusqu'à l'expiration de ses entrées. Si la connexion à Redis tombe,
+l'écoute se réabonne avec un délai croissant puis signale "resync" localement :
+les diffusions manquées entre-temps ne seront jamais reçues.
+
+Les primitives de threading sont celles que gevent remplace quand gunicorn
+tourne avec `-k gevent` : une connexion inactive ne coûte alors qu'une greenlet.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("staybnb.events")
+
+
+def _origin():
+    # Calculé à l'envoi : les workers issus d'un même fork ont chacun leur pid
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Subscription:
+    """File d'événements d'une connexion ; les plus anciens sont perdus si le client ne lit plus."""
+
+    def __init__(self, user_id, max_pending):
+        self.user_id = user_id
+        self._queue = deque(maxlen=max_pending)
+        self._ready = threading.Condition()
+
+    def put(self, item):
+        with self._ready:
+            self._queue.append(item)
+            self._ready.notify()
+
+    def get(self, timeout):
+        """Prochain (événement, données), ou None après `timeout` secondes sans rien."""
+        with self._ready:
+            if not self._queue:
+                self._ready.wait(timeout)
+            return self._queue.popleft() if self._queue else None
+
+
+class RedisRelay:
+    """Relaie les événements entre workers par un canal Redis."""
+
+    def __init__(self, url, deliver, channel="staybnb:events", retry_min=0.5, retry_max=30):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("EVENTS_BROKER_URL nécessite redis (pip install redis)") from e
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self._deliver = deliver
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def send(self, user_id, event, data, origin=None):
+        self.client.publish(self.channel, json.dumps({"user_id": user_id, "event": event, "data": data,
+                                                      "origin": origin}))
+
+    def start(self):
+        # Un seul thread d'écoute par processus, démarré à la première requête
+        # et relancé s'il s'est arrêté
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name="events-relay", daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        delay = self.retry_min
+        subscribed_before = False
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                try:
+                    pubsub.subscribe(self.channel)
+                    if subscribed_before:
+                        logger.info("relais d'événements reconnecté à %s", self.channel)
+                        self._deliver(None, "resync", None)
+                    subscribed_before = True
+                    delay = self.retry_min
+                    for message in pubsub.listen():
+                        self._receive(message)
+                finally:
+                    pubsub.close()
+            except Exception:
+                logger.warning("relais d'événements interrompu, nouvel essai dans %.1f s", delay, exc_info=True)
+            time.sleep(delay)
+            delay = min(delay * 2, self.retry_max)
+
+    def _receive(self, message):
+        # Un message illisible ou un gestionnaire en erreur ne doit pas arrêter l'écoute
+        try:
+            payload = json.loads(message["data"])
+            self._deliver(payload["user_id"], payload["event"], payload["data"], payload.get("origin"))
+        except Exception:
+            logger.exception("événement relayé ignoré")
+
+
+class Broker:
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self.relay = None
+        self._subscribers = {}
+        self._handlers = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_pending = app.config["EVENTS_MAX_PENDING"]
+        url = app.config["EVENTS_BROKER_URL"]
+        self.relay = RedisRelay(url, self._deliver) if url else None
+
+    def start(self):
+        # Écoute du relais dans chaque worker (après le fork, donc pas dans init_app)
+        if self.relay:
+            self.relay.start()
+
+    def subscribe(self, user_id):
+        self.start()
+        subscription = Subscription(user_id, self.max_pending)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscribers.pop(subscription.user_id, None)
+
+    def publish(self, user_id, event, data):
+        if self.relay:
+            self.relay.send(user_id, event, data)
+        else:
+            self._deliver(user_id, event, data)
+
+    def on_broadcast(self, event, handler):
+        self._handlers[event] = handler
+
+    def broadcast(self, event, data):
+        """Transmet `data` au gestionnaire de `event` des autres workers (rien sans relais)."""
+        if self.relay:
+            self.relay.send(None, event, data, origin=_origin())
+
+    def _deliver(self, user_id, event, data, origin=None):
+        if user_id is None:
+            # Diffusion : l'émetteur l'a déjà appliquée chez lui
+            handler = self._handlers.get(event)
+            if handler and origin != _origin():
+                handler(data)
+            return
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.put((event, data))
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
@@ -0,0 +1,146 @@
+"""Protection de l'authentification : coût du hachage, limitation des tentatives.
+
+Le hachage d'un mot de passe coûte volontairement cher (scrypt par défaut,
+quelques dizaines de ms de CPU). Sans garde-fou, une rafale de tentatives de
+connexion occupe tous les workers et la navigation ralentit pour tout le monde :
+
+    PasswordHasher     méthode configurable (`PASSWORD_HASH_METHOD`) ; un hash
+                       d'une autre méthode est refait à la connexion suivante
+    RateLimiter        seaux à jetons par clé (adresse IP, email), en mémoire
+    CredentialPool     nombre borné de hachages simultanés ; au-delà, refus
+                       immédiat plutôt qu'une file d'attente qui s'allonge
+
+hashlib libère le GIL pendant scrypt/pbkdf2 : les threads du pool calculent en
+parallèle des requêtes. Sous gunicorn `-k gevent`, le pool utilise de vrais
+threads système (voir executors.py), sinon le calcul bloquerait la boucle
+d'événements et toutes les greenlets du worker.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+from executors import native_executor
+
+
+class ServiceBusy(Exception):
+    """Trop de vérifications de mot de passe en cours dans ce processus."""
+
+
+def _full_method(method):
+    """Méthode avec tous ses paramètres, telle que werkzeug l'écrit dans le hash.
+
+    "scrypt" -> "scrypt:32768:8:1", "pbkdf2:sha256" -> "pbkdf2:sha256:600000" :
+    sans cela une méthode abrégée ne correspondrait jamais au hash stocké.
+    """
+    name, *args = method.split(":")
+    if name == "scrypt":
+        n, r, p = args or (2 ** 15, 8, 1)
+        return f"scrypt:{int(n)}:{int(r)}:{int(p)}"
+    if name == "pbkdf2":
+        hash_name = args[0] if args else "sha256"
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{int(iterations)}"
+    return method
+
+
+class PasswordHasher:
+    def __init__(self, method="scrypt:32768:8:1"):
+        self.method = method
+
+    def hash(self, password):
+        return generate_password_hash(password, method=self.method)
+
+    def verify(self, stored, password):
+        return check_password_hash(stored, password)
+
+    def needs_rehash(self, stored):
+        # Format werkzeug : "méthode:paramètres$sel$hash"
+        try:
+            return _full_method(stored.split("$", 1)[0]) != _full_method(self.method)
+        except ValueError:
+            return True
+
+
+class RateLimiter:
+    """Seau à jetons par clé : `capacity` tentatives d'affilée, puis `per_minute` par minute."""
+
+    def __init__(self, name, capacity=10, per_minute=10, max_keys=100000):
+        self.name = name
+        self.capacity = capacity
+        self.per_minute = per_minute
+        self.max_keys = max_keys
+        self.rejected = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """Consomme un jeton ; renvoie 0 si la tentative passe, sinon les secondes à attendre."""
+        if self.capacity <= 0 or key is None:
+            return 0
+        rate = self.per_minute / 60
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                self.rejected += 1
+                wait = (1 - tokens) / rate if rate else 60
+            # Les clés les plus anciennes sont oubliées (seau plein à leur retour)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class CredentialPool:
+    """Exécute les hachages dans `workers` threads, `max_pending` en attente au plus.
+
+    Avec workers=0, le calcul se fait dans la requête (toujours borné par max_pending).
+    """
+
+    def __init__(self, workers=2, max_pending=16):
+        self._executor = None
+        self._lock = threading.Lock()
+        self.configure(workers, max_pending)
+        self.rejected = 0
+
+    def configure(self, workers, max_pending):
+        with self._lock:
+            # Les threads de l'ancien pool finissent leur hachage en cours puis s'arrêtent
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = None
+            self.workers = workers
+            self.max_pending = max_pending
+            self._slots = threading.BoundedSemaphore(max(1, workers + max_pending))
+
+    def run(self, fn, *args):
+        # configure() peut remplacer le sémaphore entre-temps : on relâche celui qu'on a pris
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            self.rejected += 1
+            raise ServiceBusy()
+        try:
+            if not self.workers:
+                return fn(*args)
+            executor = self._executor
+            if executor is None:
+                with self._lock:
+                    if self._executor is None:
+                        self._executor = native_executor(self.workers, "auth")
+                    executor = self._executor
+            return executor.submit(fn, *args).result()
+        finally:
+            slots.release()
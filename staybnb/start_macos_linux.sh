@@ -11,4 +11,6 @@ python3 -m venv venv
 source venv/bin/activate
 pip install --upgrade pip
 pip install -r requirements.txt
+python3 -m flask --app app init-db
+python3 -m flask --app app seed
 python3 app.py
@@ -14,5 +14,7 @@ python -m venv venv
 call venv\Scripts\activate
 pip install --upgrade pip
 pip install -r requirements.txt
+python -m flask --app app init-db
+python -m flask --app app seed
 python app.py
 pause
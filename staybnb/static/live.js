@@ -0,0 +1,40 @@
+// Notifications en direct : flux SSE /events (nouveaux messages, réservations).
+// Le navigateur se reconnecte tout seul si la connexion tombe.
+(function () {
+  var script = document.currentScript;
+  var source = new EventSource(script.dataset.events);
+  var badge = document.getElementById("unread-badge");
+
+  function toast(title, body, href) {
+    var container = document.getElementById("live-toasts");
+    var el = document.createElement("a");
+    el.className = "toast show d-block text-decoration-none text-reset border-0 shadow-sm mb-2";
+    el.href = href;
+    var inner = document.createElement("div");
+    inner.className = "toast-body";
+    var strong = document.createElement("strong");
+    strong.textContent = title;
+    var text = document.createElement("div");
+    text.className = "text-truncate";
+    text.textContent = body;
+    inner.append(strong, text);
+    el.append(inner);
+    container.append(el);
+    setTimeout(function () { el.remove(); }, 8000);
+  }
+
+  source.addEventListener("chat", function (e) {
+    var data = JSON.parse(e.data);
+    document.dispatchEvent(new CustomEvent("staybnb:chat", { detail: data }));
+    if (data.sender_id === window.staybnbChatWith) return;  // conversation ouverte : affichée sur place
+    badge.textContent = (parseInt(badge.textContent, 10) || 0) + 1;
+    badge.classList.remove("d-none");
+    toast("Nouveau message", data.body, script.dataset.inbox);
+  });
+
+  source.addEventListener("booking", function (e) {
+    var data = JSON.parse(e.data);
+    var title = data.role === "host" ? "Nouvelle réservation" : "Réservation " + data.status;
+    toast(title, data.listing_title + " — du " + data.start + " au " + data.end, script.dataset.dashboard);
+  });
+})();
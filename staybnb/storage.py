@@ -0,0 +1,146 @@
+"""Stockage des photos : disque local ou service compatible S3.
+
+Les deux backends exposent la même petite interface, utilisée par save_photo(),
+le pipeline d'images et la route /uploads :
+
+    exists(name)        le fichier existe-t-il ?
+    open(name)          flux binaire en lecture
+    save(name, fileobj) écrit le fichier (atomique côté lecteur)
+    local_path(name)    chemin sur disque (None hors du dossier, ou backend distant)
+    url(name)           URL publique directe (None : servie par l'application)
+
+Backend S3 : `STORAGE_BACKEND=s3`, `S3_BUCKET` et, pour MinIO ou un serveur
+local de test, `S3_ENDPOINT_URL`. boto3 n'est requis (et importé) que dans ce
+cas ; les identifiants suivent la configuration AWS habituelle.
+"""
+import io
+import mimetypes
+import os
+import re
+import threading
+
+# Noms dérivés du contenu (voir images.content_name) : jamais réécrits, cache immuable
+_FINGERPRINTED = re.compile(r"^[0-9a-f]{32}(_[a-z]+)?\.[a-z]+$")
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def is_immutable(name):
+    return bool(_FINGERPRINTED.match(os.path.basename(name)))
+
+
+def content_type(name):
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def cache_control(name, max_age):
+    if is_immutable(name):
+        return f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return f"public, max-age={max_age}"
+
+
+class LocalStorage:
+    local = True
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, name):
+        from werkzeug.security import safe_join
+
+        return safe_join(self.root, name)
+
+    def exists(self, name):
+        path = self.local_path(name)
+        return path is not None and os.path.isfile(path)
+
+    def open(self, name):
+        return open(self.local_path(name), "rb")
+
+    def save(self, name, fileobj):
+        path = self.local_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Écrit à côté puis renomme : un lecteur ne voit jamais de fichier partiel
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            with open(tmp, "wb") as out:
+                while chunk := fileobj.read(64 * 1024):
+                    out.write(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def url(self, name):
+        return None
+
+
+class S3Storage:
+    local = False
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, region=None, public_url=None,
+                 presign_seconds=3600, max_age=3600):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 nécessite boto3 (pip install boto3)") from e
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self.presign_seconds = presign_seconds
+        self.max_age = max_age
+        # Adressage par chemin : MinIO et les serveurs de test n'ont pas de DNS par bucket
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region,
+                                   config=Config(s3={"addressing_style": "path"}))
+
+    def _key(self, name):
+        return self.prefix + name
+
+    def local_path(self, name):
+        return None
+
+    def exists(self, name):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def open(self, name):
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(name))["Body"]
+        return io.BytesIO(body.read())
+
+    def save(self, name, fileobj):
+        # En-têtes stockés avec l'objet : le CDN / navigateur les reçoit directement
+        self.client.upload_fileobj(fileobj, self.bucket, self._key(name), ExtraArgs={
+            "ContentType": content_type(name),
+            "CacheControl": cache_control(name, self.max_age),
+        })
+
+    def url(self, name):
+        if self.public_url:
+            return f"{self.public_url}/{self._key(name)}"
+        return None
+
+    def presigned_url(self, name):
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self._key(name)}, ExpiresIn=self.presign_seconds)
+
+
+def make_storage(config):
+    if config["STORAGE_BACKEND"] == "s3":
+        return S3Storage(
+            config["S3_BUCKET"],
+            prefix=config["S3_PREFIX"],
+            endpoint_url=config["S3_ENDPOINT_URL"],
+            region=config["S3_REGION"],
+            public_url=config["S3_PUBLIC_URL"],
+            presign_seconds=config["S3_PRESIGN_SECONDS"],
+            max_age=config["UPLOADS_MAX_AGE"],
+        )
+    return LocalStorage(config["UPLOAD_FOLDER"])
@@ -0,0 +1,58 @@
+"""Tests de security.py (lancer depuis staybnb/ : python -m unittest discover tests)."""
+import threading
+import unittest
+
+from werkzeug.security import generate_password_hash
+
+from security import CredentialPool, PasswordHasher, ServiceBusy
+
+
+class NeedsRehashTest(unittest.TestCase):
+    def test_abbreviated_scrypt_matches_its_expanded_hash(self):
+        stored = generate_password_hash("secret12", method="scrypt")
+        self.assertTrue(stored.startswith("scrypt:32768:8:1$"))
+        self.assertFalse(PasswordHasher("scrypt").needs_rehash(stored))
+        self.assertFalse(PasswordHasher("scrypt:32768:8:1").needs_rehash(stored))
+
+    def test_abbreviated_pbkdf2_matches_its_expanded_hash(self):
+        stored = "pbkdf2:sha256:600000$salt$hash"
+        self.assertFalse(PasswordHasher("pbkdf2:sha256").needs_rehash(stored))
+        self.assertFalse(PasswordHasher("pbkdf2").needs_rehash(stored))
+
+    def test_other_parameters_need_rehash(self):
+        self.assertTrue(PasswordHasher("scrypt").needs_rehash("scrypt:16384:8:1$salt$hash"))
+        self.assertTrue(PasswordHasher("pbkdf2:sha256").needs_rehash("pbkdf2:sha256:1000$salt$hash"))
+        self.assertTrue(PasswordHasher("scrypt").needs_rehash("pbkdf2:sha256:600000$salt$hash"))
+        self.assertTrue(PasswordHasher("scrypt").needs_rehash("garbage"))
+
+
+class CredentialPoolTest(unittest.TestCase):
+    def test_reconfigure_during_run_releases_the_slot_taken(self):
+        pool = CredentialPool(workers=0, max_pending=1)
+        started, finish = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            finish.wait(5)
+
+        worker = threading.Thread(target=pool.run, args=(slow,))
+        worker.start()
+        started.wait(5)
+        old_slots = pool._slots
+        pool.configure(workers=0, max_pending=1)
+        finish.set()
+        worker.join(5)
+        # L'ancien sémaphore retrouve son jeton, le nouveau n'en reçoit pas un de trop
+        self.assertTrue(old_slots.acquire(blocking=False))
+        self.assertTrue(pool._slots.acquire(blocking=False))
+
+    def test_busy_pool_rejects(self):
+        pool = CredentialPool(workers=0, max_pending=1)
+        pool._slots.acquire()
+        with self.assertRaises(ServiceBusy):
+            pool.run(lambda: None)
+        self.assertEqual(pool.rejected, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()